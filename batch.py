@@ -0,0 +1,66 @@
+import asyncio, logging, time
+from typing import Any, Awaitable, Callable, Optional
+
+
+class MicroBatcher:
+    """Склеивает одиночные submit() в пачки для run_batch(list) -> list.
+
+    Пачка уходит, как только набралось max_size элементов или с первого
+    элемента прошло max_wait секунд — больше пачка, меньше запросов, но
+    дольше ждёт первый. Ошибка run_batch достаётся всем элементам пачки.
+    """
+
+    def __init__(self, run_batch: Callable[[list], Awaitable[list]], max_size: int, max_wait: float):
+        self.run_batch = run_batch
+        self.max_size = max(1, max_size)
+        self.max_wait = max_wait
+        self._pending: list[tuple[Any, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set[asyncio.Task] = set()
+        self.batches = 0
+        self.items = 0
+        self.batch_sec = 0.0
+
+    async def submit(self, payload: Any) -> Any:
+        fut = asyncio.get_running_loop().create_future()
+        self._pending.append((payload, fut))
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush)
+        return await fut
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: list):
+        t0 = time.monotonic()
+        try:
+            results = await self.run_batch([p for p, _ in batch])
+            if len(results) != len(batch):
+                raise ValueError(f"batch returned {len(results)} results for {len(batch)} items")
+        except Exception as e:
+            logging.warning(f"Batch of {len(batch)} failed: {e}")
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        finally:
+            self.batches += 1
+            self.items += len(batch)
+            self.batch_sec += time.monotonic() - t0
+        for (_, fut), res in zip(batch, results):
+            if not fut.done():
+                fut.set_result(res)
+
+    def stats(self) -> dict:
+        return {"batches": self.batches, "items": self.items,
+                "avg_size": round(self.items / self.batches, 1) if self.batches else 0.0,
+                "avg_batch_sec": round(self.batch_sec / self.batches, 2) if self.batches else 0.0}
@@ -0,0 +1,97 @@
+"""Скоринг/эмодзи/ссылка в заголовке: прежняя реализация против KeywordMatcher.
+
+Запуск: python bench/bench_matcher.py [N]
+Сначала проверяет, что результаты совпадают на всём корпусе, затем меряет пропускную способность.
+"""
+import os, sys, re, time, random
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("BOT_TOKEN", "0:bench")
+os.environ.setdefault("CHANNEL_ID", "-1000000000000")
+
+import main  # noqa: E402
+
+
+# === прежняя реализация (до matcher.py) ===
+def legacy_priority(title, summary):
+    text = f"{title} {summary}".lower()
+    score, urgent = 0.0, False
+    for kws, base, is_urgent in main.PRIORITY_RULES:
+        if any(k in text for k in kws):
+            score += base
+            urgent = urgent or is_urgent
+    score += min(len(summary) / 500.0, 2.0)
+    return score, urgent
+
+def legacy_emoji(title, summary, urgent):
+    if urgent:
+        return "🚨"
+    txt = f"{title} {summary}".lower()
+    for kws, emoji in main.EMOJI_RULES:
+        if any(k in txt for k in kws):
+            return emoji
+    return "📰"
+
+def legacy_linkify(title_ru, link):
+    for kw in main.KEYWORDS_FOR_LINK:
+        pattern = r'(?<![A-Яа-яA-Za-z0-9])(' + re.escape(kw) + r')(?![A-Яа-яA-Za-z0-9])'
+        if re.search(pattern, title_ru):
+            return re.sub(pattern, rf'<a href="{link}">\1</a>', title_ru, count=1)
+    return None
+
+
+def corpus(n, seed=7):
+    r = random.Random(seed)
+    filler_en = "markets shares investors said company quarter week report growth data bank yields".split()
+    filler_ru = "рынки акции инвесторы компания квартал неделя отчёт рост данные банк доходность".split()
+    topical = [k for kws, _, _ in main.PRIORITY_RULES for k in kws] + [k for kws, _ in main.EMOJI_RULES for k in kws]
+    out = []
+    for _ in range(n):
+        filler = filler_ru if r.random() < 0.5 else filler_en
+        words = [r.choice(filler) for _ in range(r.randint(6, 14))]
+        for _ in range(r.randint(0, 3)):
+            words.insert(r.randrange(len(words) + 1), r.choice(topical + main.KEYWORDS_FOR_LINK))
+        title = " ".join(words).capitalize()
+        summary = " ".join(r.choice(filler) for _ in range(r.randint(20, 60)))
+        out.append((title, summary))
+    return out
+
+
+def bench(label, fn, items, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for ti, su in items:
+            fn(ti, su)
+        best = min(best, time.perf_counter() - t0)
+    print(f"{label:<8} {len(items) / best:>12,.0f} items/s  ({best * 1000:.1f} ms)")
+    return best
+
+
+def legacy_all(ti, su):
+    pr, urg = legacy_priority(ti, su)
+    legacy_emoji(ti, su, urg)
+    legacy_linkify(ti, "https://x")
+
+def matcher_all(ti, su):
+    hits = main.topic_hits(ti, su)
+    pr, urg = main.compute_priority_and_urgent(ti, su, hits)
+    main.pick_emoji(ti, su, urg, hits)
+    main.linkify_in_title(ti, "https://x")
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    items = corpus(n)
+    mismatches = 0
+    for ti, su in items:
+        pr, urg = legacy_priority(ti, su)
+        if (pr, urg) != main.compute_priority_and_urgent(ti, su) or legacy_emoji(ti, su, urg) != main.pick_emoji(ti, su, urg):
+            mismatches += 1
+        old = legacy_linkify(ti, "https://x")
+        if old is not None and old != main.linkify_in_title(ti, "https://x"):
+            mismatches += 1
+    print(f"corpus: {n} headlines, mismatches: {mismatches}")
+    old = bench("legacy", legacy_all, items)
+    new = bench("matcher", matcher_all, items)
+    print(f"speedup: x{old / new:.2f}")
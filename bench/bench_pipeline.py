@@ -0,0 +1,273 @@
+"""Нагрузочный прогон fetch_all_and_score / format_post / worker_loop без внешней сети.
+
+Запуск: python bench/bench_pipeline.py [--feeds 10,100,1000] [--out bench/results.jsonl] [параметры заглушек]
+
+Поднимает bench/mock_servers.py отдельным процессом и на каждое число лент
+запускает отдельный дочерний процесс (чистый main, своя data.db во временном
+каталоге). Ребёнок меряет:
+  fetch_all     — холодный проход по всем лентам и повторный (304/без новых элементов), items/s;
+  format_post   — --format-items элементов параллельно, items/s;
+  worker_loop   — один цикл через конвейер и outbox до опустошения очереди;
+  stages        — p50/p99 по стадиям: fetch, parse, admit, enrich, llm, send;
+  loop_lag_ms   — задержка event loop (таймер каждые 10 мс), peak_rss_mb;
+  fetch_all.rss_retained_mb — сколько RSS держат результат и кэш лент после холодного прохода.
+Результат — строка JSON на прогон в --out (плюс commit и параметры), чтобы регрессии
+было видно по истории; в консоль — короткая таблица.
+"""
+import os, sys, json, time, socket, asyncio, argparse, resource, subprocess, tempfile
+from datetime import datetime, timezone
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+MOCK_FLAGS = ("items", "summary_words", "html_bytes", "urgent_frac", "feed_latency_ms", "slow_feed_frac", "change_every_sec", "new_per_change",
+              "llm_latency_ms", "llm_ms_per_item", "llm_429", "llm_bad_item", "tg_latency_ms", "tg_429", "tg_retry_after")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    sys.path.insert(0, HERE)
+    from mock_servers import build_parser as mock_parser
+    p = mock_parser()
+    p.description = __doc__
+    p.set_defaults(port=0)
+    p.add_argument("--feeds", default="10,100,1000", help="числа лент через запятую")
+    p.add_argument("--format-items", type=int, default=200)
+    p.add_argument("--max-posts-per-cycle", type=int, default=20)
+    p.add_argument("--tg-rate-per-min", type=float, default=6000, help="OUTBOX_RATE_PER_MIN на время прогона")
+    p.add_argument("--llm-batch-size", type=int, default=0, help="LLM_BATCH_SIZE на время прогона (0 — без пачек)")
+    p.add_argument("--llm-batch-wait-ms", type=int, default=300)
+    p.add_argument("--http-per-host", type=int, default=0,
+                   help="HTTP_LIMIT_PER_HOST на время прогона (все ленты на одном хосте; 0 — без лимита)")
+    p.add_argument("--timeout", type=float, default=120, help="предел на worker_loop, сек")
+    p.add_argument("--out", default=os.path.join(HERE, "results.jsonl"))
+    p.add_argument("--child", type=int, default=0, help=argparse.SUPPRESS)
+    p.add_argument("--mock-url", default="", help=argparse.SUPPRESS)
+    return p
+
+
+def pct(xs: list, q: float) -> float:
+    if not xs:
+        return 0.0
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(round(q * (len(xs) - 1))))]
+
+
+def rss_mb() -> float:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def summary_ms(xs: list) -> dict:
+    return {"n": len(xs), "p50_ms": round(pct(xs, 0.5) * 1000, 2), "p99_ms": round(pct(xs, 0.99) * 1000, 2),
+            "max_ms": round(max(xs) * 1000, 2) if xs else 0.0}
+
+
+# === дочерний процесс: один прогон на N лент ===
+async def run_child(args) -> dict:
+    import main
+    import metrics
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+
+    n, mock = args.child, args.mock_url
+    samples: dict[str, list] = {}
+
+    def timed(stage, fn):
+        async def wrapper(*a, **kw):
+            t0 = time.perf_counter()
+            try:
+                return await fn(*a, **kw)
+            finally:
+                samples.setdefault(stage, []).append(time.perf_counter() - t0)
+        return wrapper
+
+    main.fetch_feed = timed("fetch", main.fetch_feed)
+    main.parse_pool.parse = timed("parse", main.parse_pool.parse)
+    main.admit_items = timed("admit", main.admit_items)
+    main.localize = timed("enrich", main.localize)
+    main.openai_chat = timed("llm", main.openai_chat)
+
+    lags: list[float] = []
+
+    async def lag_probe():
+        while True:
+            t0 = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lags.append(max(0.0, time.perf_counter() - t0 - 0.01))
+
+    probe = asyncio.create_task(lag_probe())
+    urls = [f"{mock}/feed/{i}" for i in range(n)]
+    with open("feeds.csv", "w", encoding="utf-8") as f:
+        f.write("url\n" + "\n".join(urls) + "\n")
+    main.FEEDS_FILE = "feeds.csv"
+    await main.db_init()
+    result: dict = {"feeds": n}
+
+    # 1) скачивание + скоринг: холодный проход и повторный
+    rss0 = rss_mb()
+    t0 = time.perf_counter()
+    scored = await main.fetch_all_and_score(urls)
+    cold = time.perf_counter() - t0
+    rss_retained = rss_mb() - rss0
+    t0 = time.perf_counter()
+    await main.fetch_all_and_score(urls)
+    warm = time.perf_counter() - t0
+    result["fetch_all"] = {"items": len(scored), "cold_sec": round(cold, 3), "warm_sec": round(warm, 3),
+                           "rss_retained_mb": round(rss_retained, 1),
+                           "items_per_sec": round(len(scored) / cold, 1) if cold else None}
+
+    # 2) format_post на выборке, кэш LLM потом чистим — worker_loop должен звать LLM честно
+    sample = scored[:args.format_items]
+    t0 = time.perf_counter()
+    await asyncio.gather(*(main.format_post(it, pr, urg) for pr, urg, it in sample))
+    dt = time.perf_counter() - t0
+    result["format_post"] = {"items": len(sample), "sec": round(dt, 3),
+                             "items_per_sec": round(len(sample) / dt, 1) if dt else None}
+    def reset(con):
+        with con:
+            con.execute("DELETE FROM llm_cache")
+            con.execute("DELETE FROM feed_state")
+    await main.store.run(reset)
+    main.llm_cache._mem.clear()
+    main._feed_items.clear()
+    main._feed_states = None
+
+    # 3) worker_loop: один цикл до пустой очереди outbox
+    session = AiohttpSession(api=TelegramAPIServer.from_base(mock))
+    bot = Bot("0:bench", session=session)
+    real_send = bot.send_message
+
+    async def send_message(*a, **kw):
+        t0 = time.perf_counter()
+        try:
+            return await real_send(*a, **kw)
+        finally:
+            samples.setdefault("send", []).append(time.perf_counter() - t0)
+
+    class TimedBot:
+        pass
+    timed_bot = TimedBot()
+    timed_bot.send_message = send_message
+    main.outbox.start(timed_bot)
+    t0 = time.perf_counter()
+    task = asyncio.create_task(main.worker_loop(timed_bot))
+    first_send = None
+    while time.perf_counter() - t0 < args.timeout:
+        await asyncio.sleep(0.05)
+        if first_send is None and main.outbox.sent:
+            first_send = time.perf_counter() - t0
+        cycles = list(metrics.tracer.cycles)
+        if cycles and cycles[-1]["wall_sec"] is not None and main.outbox.stats()["queued"] == 0:
+            break
+    wall = time.perf_counter() - t0
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    await main.outbox.stop()
+    cycle = list(metrics.tracer.cycles)[-1] if metrics.tracer.cycles else {}
+    ob = main.outbox.stats()
+    result["worker_loop"] = {"wall_sec": round(wall, 3), "cycle_wall_sec": cycle.get("wall_sec"),
+                             "fetched": cycle.get("fetched"), "queued": cycle.get("queued"),
+                             "delivered": ob["sent"], "flood_waits": ob["flood_waits"],
+                             "first_send_sec": round(first_send, 3) if first_send is not None else None,
+                             "posts_per_sec": round(ob["sent"] / wall, 2) if wall else None,
+                             "timed_out": wall >= args.timeout}
+
+    probe.cancel()
+    await asyncio.gather(probe, return_exceptions=True)
+    result["stages"] = {k: summary_ms(v) for k, v in sorted(samples.items())}
+    if main.llm_batcher is not None:
+        result["llm_batch"] = main.llm_batcher.stats()
+    result["loop_lag_ms"] = summary_ms(lags)
+    result["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    result["http"] = main.http.stats()
+    await session.close()
+    await main.llm.close()
+    await main.http.close()
+    main.parse_pool.close()
+    await main.store.close()
+    return result
+
+
+# === родитель ===
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_port(port: int, timeout: float = 10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("mock servers did not start")
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return ""
+
+
+def run_parent(args):
+    port = args.port or free_port()
+    mock_cmd = [sys.executable, os.path.join(HERE, "mock_servers.py"), "--port", str(port)]
+    for k in MOCK_FLAGS:
+        mock_cmd += [f"--{k.replace('_', '-')}", str(getattr(args, k))]
+    if args.atom:
+        mock_cmd.append("--atom")
+    if args.no_304:
+        mock_cmd.append("--no-304")
+    mock = subprocess.Popen(mock_cmd)
+    try:
+        wait_port(port)
+        mock_url = f"http://127.0.0.1:{port}"
+        env = dict(os.environ, BOT_TOKEN="0:bench", CHANNEL_ID="-1000000000001", OPENAI_API_KEY="bench",
+                   OPENAI_URL=f"{mock_url}/v1/chat/completions", CONFIG_FILE="bench-no-config.json",
+                   SCHED_STARTUP_SPREAD_SEC="0", SLOWDOWN_AFTER_BURST="0", MIN_SECONDS_BETWEEN_POSTS="0",
+                   MAX_POSTS_PER_CYCLE=str(args.max_posts_per_cycle),
+                   OUTBOX_RATE_PER_MIN=str(args.tg_rate_per_min), OUTBOX_BURST="20", RETRY_AFTER_GRACE="0",
+                   ENABLE_DIGEST="0", PYTHONPATH=ROOT,
+                   LLM_BATCH_SIZE=str(args.llm_batch_size), LLM_BATCH_WAIT_MS=str(args.llm_batch_wait_ms),
+                   HTTP_LIMIT_PER_HOST=str(args.http_per_host))
+        params = {k: getattr(args, k) for k in MOCK_FLAGS + ("atom", "no_304", "format_items",
+                                                             "max_posts_per_cycle", "tg_rate_per_min",
+                                                             "llm_batch_size", "llm_batch_wait_ms", "http_per_host")}
+        print(f"{'feeds':>6} {'items/s':>9} {'warm s':>7} {'fmt/s':>7} {'llm n':>6} {'1st send':>8} {'posts':>6} "
+              f"{'fetch p99':>9} {'llm p99':>8} {'send p99':>8} {'lag p99':>8} {'rss MB':>7}")
+        for n in [int(x) for x in args.feeds.split(",") if x.strip()]:
+            with tempfile.TemporaryDirectory() as tmp:
+                cmd = [sys.executable, os.path.abspath(__file__), "--child", str(n), "--mock-url", mock_url,
+                       "--format-items", str(args.format_items), "--timeout", str(args.timeout)]
+                proc = subprocess.run(cmd, cwd=tmp, env=env, capture_output=True, text=True)
+            if proc.returncode != 0:
+                print(proc.stderr[-3000:], file=sys.stderr)
+                raise SystemExit(f"child for {n} feeds failed")
+            res = json.loads(proc.stdout.strip().splitlines()[-1])
+            st, wl = res["stages"], res["worker_loop"]
+            print(f"{n:>6} {res['fetch_all']['items_per_sec']:>9} {res['fetch_all']['warm_sec']:>7} "
+                  f"{res['format_post']['items_per_sec']:>7} {st.get('llm', {}).get('n', 0):>6} {wl['first_send_sec']!s:>8} {wl['delivered']:>6} "
+                  f"{st.get('fetch', {}).get('p99_ms', 0):>9} {st.get('llm', {}).get('p99_ms', 0):>8} "
+                  f"{st.get('send', {}).get('p99_ms', 0):>8} {res['loop_lag_ms']['p99_ms']:>8} {res['peak_rss_mb']:>7}")
+            record = {"ts": datetime.now(timezone.utc).isoformat(timespec="seconds"), "commit": git_commit(),
+                      "python": sys.version.split()[0], "params": params, **res}
+            if args.out:
+                with open(args.out, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    finally:
+        mock.terminate()
+        mock.wait()
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    if args.child:
+        import logging
+        logging.disable(logging.WARNING)
+        print(json.dumps(asyncio.run(run_child(args))))
+    else:
+        run_parent(args)
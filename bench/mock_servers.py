@@ -0,0 +1,159 @@
+"""Локальные заглушки для нагрузочных прогонов: RSS/Atom-ленты, OpenAI и Telegram Bot API.
+
+Запуск: python bench/mock_servers.py --port 18700 [--items 30 --feed-latency-ms 50 ...]
+
+  GET  /feed/{i}                       лента i (чётные — RSS, нечётные — Atom, если --atom)
+  POST /v1/chat/completions            ответ в формате OpenAI (на пакетный запрос — JSON с items)
+  POST /bot{token}/{method}            Telegram Bot API (sendMessage и всё остальное — ok)
+  GET  /stats                          счётчики запросов, 304 и 429
+
+Лента обновляется раз в --change-every-sec: сверху появляется --new-per-change новых
+элементов. ETag/Last-Modified отдаются всегда, 304 — если не задан --no-304.
+"""
+import sys, json, time, random, asyncio, argparse
+from email.utils import formatdate
+
+from aiohttp import web
+
+WORDS = ("company said report week investors growth earnings quarter forecast exports budget market "
+         "shares data analysts revenue outlook demand supply prices index traders session").split()
+# слова, на которые срабатывают PRIORITY_RULES/EMOJI_RULES (часть — срочные); попадаются редко
+TOPICAL = "oil brent inflation bank bonds yields gas ruble yuan dollar tariffs".split()
+TOPICAL_FRAC = 0.1
+
+
+def build_parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=18700)
+    p.add_argument("--items", type=int, default=30, help="элементов в ленте")
+    p.add_argument("--summary-words", type=int, default=60, help="слов в description (размер ленты)")
+    p.add_argument("--html-bytes", type=int, default=0, help="HTML-разметки в description сверх текста (как у реальных лент)")
+    p.add_argument("--atom", action="store_true", help="нечётные ленты — Atom")
+    p.add_argument("--urgent-frac", type=float, default=0.02, help="доля срочных заголовков")
+    p.add_argument("--feed-latency-ms", type=float, default=50)
+    p.add_argument("--slow-feed-frac", type=float, default=0.05, help="доля лент в 10 раз медленнее")
+    p.add_argument("--change-every-sec", type=float, default=60)
+    p.add_argument("--new-per-change", type=int, default=2)
+    p.add_argument("--no-304", action="store_true", help="игнорировать If-None-Match/If-Modified-Since")
+    p.add_argument("--llm-latency-ms", type=float, default=300)
+    p.add_argument("--llm-ms-per-item", type=float, default=150, help="добавка к задержке за каждую новость в пачке")
+    p.add_argument("--llm-429", type=float, default=0.0, help="доля ответов 429 от OpenAI")
+    p.add_argument("--llm-bad-item", type=float, default=0.0, help="доля элементов пачки с битым ответом")
+    p.add_argument("--tg-latency-ms", type=float, default=30)
+    p.add_argument("--tg-429", type=float, default=0.0, help="доля ответов RetryAfter от Telegram")
+    p.add_argument("--tg-retry-after", type=int, default=1)
+    p.add_argument("--seed", type=int, default=1)
+    return p
+
+
+class Mocks:
+    def __init__(self, args):
+        self.a = args
+        self.rnd = random.Random(args.seed)
+        self.started = time.time()
+        self.stats = {"feed": 0, "feed_304": 0, "llm": 0, "llm_429": 0, "llm_batched_items": 0, "tg": 0, "tg_429": 0}
+
+    def _version(self) -> int:
+        return int((time.time() - self.started) / self.a.change_every_sec) if self.a.change_every_sec > 0 else 0
+
+    def _text(self, r: random.Random, n: int) -> str:
+        return " ".join(r.choice(TOPICAL if r.random() < TOPICAL_FRAC else WORDS) for _ in range(n))
+
+    def render_feed(self, i: int, version: int) -> str:
+        # элемент k (0 — самый старый) стабилен между версиями: тот же guid, тот же текст
+        newest = self.a.items + version * self.a.new_per_change
+        atom = self.a.atom and i % 2 == 1
+        entries = []
+        for k in range(newest - 1, newest - 1 - self.a.items, -1):
+            r = random.Random(i * 1_000_003 + k)
+            title = f"{self._text(r, 8).capitalize()} {i}-{k}"
+            if r.random() < self.a.urgent_frac:
+                title = f"Sanctions: {title}"
+            summary = self._text(r, self.a.summary_words)
+            if self.a.html_bytes:
+                pad = '<div class="article-body"><p><img src="http://bench.local/i.jpg" alt=""/></p></div>'
+                summary = f"<![CDATA[<p>{summary}</p>{pad * (self.a.html_bytes // len(pad))}]]>"
+            link = f"http://bench.local/{i}/{k}"
+            if atom:
+                entries.append(f"<entry><id>{i}-{k}</id><title>{title}</title><link href=\"{link}\"/>"
+                               f"<summary>{summary}</summary><updated>2025-01-01T00:00:00Z</updated></entry>")
+            else:
+                entries.append(f"<item><guid>{i}-{k}</guid><title>{title}</title><link>{link}</link>"
+                               f"<description>{summary}</description></item>")
+        if atom:
+            return (f'<?xml version="1.0" encoding="utf-8"?><feed xmlns="http://www.w3.org/2005/Atom">'
+                    f"<title>bench {i}</title>{''.join(entries)}</feed>")
+        return f'<?xml version="1.0"?><rss version="2.0"><channel><title>bench {i}</title>{"".join(entries)}</channel></rss>'
+
+    async def feed(self, request: web.Request):
+        i = int(request.match_info["i"])
+        self.stats["feed"] += 1
+        slow = random.Random(i).random() < self.a.slow_feed_frac
+        await asyncio.sleep(self.a.feed_latency_ms / 1000 * (10 if slow else 1) * self.rnd.uniform(0.5, 1.5))
+        version = self._version()
+        etag = f'"{i}-{version}"'
+        last_modified = formatdate(self.started + version * self.a.change_every_sec, usegmt=True)
+        if not self.a.no_304 and request.headers.get("If-None-Match") == etag:
+            self.stats["feed_304"] += 1
+            return web.Response(status=304, headers={"ETag": etag, "Last-Modified": last_modified})
+        return web.Response(text=self.render_feed(i, version), content_type="application/rss+xml",
+                            headers={"ETag": etag, "Last-Modified": last_modified})
+
+    async def openai(self, request: web.Request):
+        self.stats["llm"] += 1
+        body = await request.json()
+        prompt = body["messages"][-1]["content"]
+        batch = None
+        if '"items"' in prompt:
+            try:
+                batch = json.loads(prompt.rsplit("\n\n", 1)[-1])
+            except ValueError:
+                pass
+        n = len(batch) if batch else 1
+        await asyncio.sleep((self.a.llm_latency_ms + self.a.llm_ms_per_item * n) / 1000 * self.rnd.uniform(0.5, 1.5))
+        if self.rnd.random() < self.a.llm_429:
+            self.stats["llm_429"] += 1
+            return web.json_response({"error": {"message": "rate limited"}}, status=429, headers={"Retry-After": "1"})
+        if batch:
+            self.stats["llm_batched_items"] += n
+            items = [{"id": it["id"], "title_ru": f"Заголовок: {it['title'][:100]}",
+                      "summary": f"Пересказ: {it['summary'][:150]}"}
+                     for it in batch if self.rnd.random() >= self.a.llm_bad_item]
+            content = "```json\n" + json.dumps({"items": items}, ensure_ascii=False) + "\n```"
+        else:
+            content = f"Пересказ: {prompt.rsplit(chr(10), 1)[-1][:120]}"
+        return web.json_response({"choices": [{"message": {"role": "assistant", "content": content}}]})
+
+    async def telegram(self, request: web.Request):
+        self.stats["tg"] += 1
+        data = await request.post()
+        await asyncio.sleep(self.a.tg_latency_ms / 1000 * self.rnd.uniform(0.5, 1.5))
+        if request.match_info["method"].lower() == "sendmessage" and self.rnd.random() < self.a.tg_429:
+            self.stats["tg_429"] += 1
+            ra = self.a.tg_retry_after
+            return web.json_response({"ok": False, "error_code": 429,
+                                      "description": f"Too Many Requests: retry after {ra}",
+                                      "parameters": {"retry_after": ra}}, status=429)
+        chat_id = int(data.get("chat_id") or 0)
+        return web.json_response({"ok": True, "result": {
+            "message_id": self.stats["tg"], "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "channel"}, "text": data.get("text", "")}})
+
+    async def get_stats(self, request: web.Request):
+        return web.json_response(self.stats)
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=4 * 1024 * 1024)
+        app.router.add_get("/feed/{i}", self.feed)
+        app.router.add_post("/v1/chat/completions", self.openai)
+        app.router.add_post("/bot{token}/{method}", self.telegram)
+        app.router.add_get("/stats", self.get_stats)
+        return app
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    print(f"mock servers on http://{args.host}:{args.port}", file=sys.stderr, flush=True)
+    web.run_app(Mocks(args).app(), host=args.host, port=args.port, print=None, access_log=None,
+                backlog=4096)
@@ -0,0 +1,134 @@
+import os, re, sqlite3, hashlib, time, logging
+from collections import OrderedDict
+from typing import Optional
+
+from metrics import LLM_CACHE_LOOKUPS
+
+LLM_CACHE_TTL_HOURS = float(os.getenv("LLM_CACHE_TTL_HOURS", "168"))   # неделя
+LLM_CACHE_MAX_ROWS = int(os.getenv("LLM_CACHE_MAX_ROWS", "20000"))
+LLM_CACHE_MEM_ITEMS = int(os.getenv("LLM_CACHE_MEM_ITEMS", "2000"))
+EVICT_EVERY_PUTS = 200
+
+
+def normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", text or "").strip().casefold()
+
+
+class LLMCache:
+    """Кэш ответов LLM: LRU в памяти поверх таблицы llm_cache в общем Store."""
+
+    def __init__(self, store, ttl_sec: float = LLM_CACHE_TTL_HOURS * 3600,
+                 max_rows: int = LLM_CACHE_MAX_ROWS, mem_items: int = LLM_CACHE_MEM_ITEMS):
+        self.store = store
+        self.ttl_sec = ttl_sec
+        self.max_rows = max_rows
+        self.mem_items = mem_items
+        self._mem: OrderedDict[str, tuple[str, float, float]] = OrderedDict()  # key -> (value, created, latency)
+        self._puts = 0
+        self.hits_mem = 0
+        self.hits_db = 0
+        self.misses = 0
+        self.saved_sec = 0.0
+
+    async def init(self):
+        await self.store.run(_init_schema)
+
+    @staticmethod
+    def make_key(kind: str, text: str, model: str, max_chars: int = 0) -> str:
+        h = hashlib.sha1(normalize(text).encode("utf-8")).hexdigest()
+        return f"{kind}:{model}:{max_chars}:{h}"
+
+    async def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        hit = self._mem.get(key)
+        if hit is not None:
+            value, created, latency = hit
+            if now - created <= self.ttl_sec:
+                self._mem.move_to_end(key)
+                self.hits_mem += 1
+                LLM_CACHE_LOOKUPS.inc(result="mem")
+                self.saved_sec += latency
+                return value
+            del self._mem[key]
+
+        row = await self.store.run(_get, key, now, now - self.ttl_sec)
+        if row is None:
+            self.misses += 1
+            LLM_CACHE_LOOKUPS.inc(result="miss")
+            return None
+        value, created, latency = row
+        self._remember(key, value, created, latency or 0.0)
+        self.hits_db += 1
+        LLM_CACHE_LOOKUPS.inc(result="db")
+        self.saved_sec += latency or 0.0
+        return value
+
+    async def put(self, key: str, value: str, latency: float = 0.0):
+        if not value:
+            return
+        now = time.time()
+        self._remember(key, value, now, latency)
+        await self.store.run(_put, key, value, now, latency)
+        self._puts += 1
+        if self._puts % EVICT_EVERY_PUTS == 0:
+            await self.evict()
+
+    async def evict(self):
+        expired, overflow = await self.store.run(_evict, time.time() - self.ttl_sec, self.max_rows)
+        if expired or overflow:
+            logging.info(f"LLM cache evicted: expired={expired} overflow={overflow}")
+
+    def _remember(self, key: str, value: str, created: float, latency: float):
+        self._mem[key] = (value, created, latency)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.mem_items:
+            self._mem.popitem(last=False)
+
+    def stats(self) -> dict:
+        hits = self.hits_mem + self.hits_db
+        total = hits + self.misses
+        return {
+            "hits_mem": self.hits_mem,
+            "hits_db": self.hits_db,
+            "misses": self.misses,
+            "hit_rate": round(hits / total, 3) if total else 0.0,
+            "saved_calls": hits,
+            "saved_sec": round(self.saved_sec, 1),
+            "mem_items": len(self._mem),
+        }
+
+
+def _init_schema(con: sqlite3.Connection):
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS llm_cache (
+        key       TEXT PRIMARY KEY,
+        kind      TEXT,
+        value     TEXT,
+        created   REAL,
+        last_used REAL,
+        latency   REAL DEFAULT 0.0
+    )
+    """)
+    con.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache(last_used)")
+    con.commit()
+
+def _get(con: sqlite3.Connection, key: str, now: float, min_created: float):
+    row = con.execute("SELECT value, created, latency FROM llm_cache WHERE key=? AND created >= ?",
+                      (key, min_created)).fetchone()
+    if row is not None:
+        with con:
+            con.execute("UPDATE llm_cache SET last_used=? WHERE key=?", (now, key))
+    return row
+
+def _put(con: sqlite3.Connection, key: str, value: str, now: float, latency: float):
+    with con:
+        con.execute("""INSERT OR REPLACE INTO llm_cache (key, kind, value, created, last_used, latency)
+                       VALUES (?, ?, ?, ?, ?, ?)""", (key, key.split(":", 1)[0], value, now, now, latency))
+
+def _evict(con: sqlite3.Connection, min_created: float, max_rows: int) -> tuple[int, int]:
+    with con:
+        expired = con.execute("DELETE FROM llm_cache WHERE created < ?", (min_created,)).rowcount
+        overflow = con.execute("""DELETE FROM llm_cache WHERE key IN (
+                                      SELECT key FROM llm_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)""",
+                               (max_rows,)).rowcount
+    return expired, overflow
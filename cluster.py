@@ -0,0 +1,225 @@
+import os, re, time, random, sqlite3, hashlib, logging
+from array import array
+from typing import Callable, Iterable, Optional
+
+STORY_NUM_PERM = int(os.getenv("STORY_NUM_PERM", "32"))
+STORY_BANDS = int(os.getenv("STORY_BANDS", "16"))   # 16x2: ловим кандидатов щедро, отсев — по оценке Жаккара
+STORY_SIM_THRESHOLD = float(os.getenv("STORY_SIM_THRESHOLD", "0.5"))
+STORY_WINDOW_HOURS = float(os.getenv("STORY_WINDOW_HOURS", "36"))
+SIG_CACHE_ITEMS = 20000
+
+_MASKS = [random.Random(20251031 + i).getrandbits(64) for i in range(256)]
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def _h64(s: str) -> int:
+    return int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def shingles(text: str) -> set[int]:
+    words = _WORD_RE.findall((text or "").casefold())
+    if len(words) < 2:
+        return {_h64(w) for w in words}
+    return {_h64(f"{a} {b}") for a, b in zip(words, words[1:])}
+
+
+class StoryIndex:
+    """Кластеры одной и той же истории из разных лент (MinHash + LSH).
+
+    Держит в памяти и в таблице story_sig подписи опубликованных историй за
+    скользящее окно; новый элемент, похожий на любую из них или на более
+    приоритетный элемент текущего цикла, считается дублем.
+    """
+
+    def __init__(self, store, num_perm: int = STORY_NUM_PERM, bands: int = STORY_BANDS,
+                 threshold: float = STORY_SIM_THRESHOLD, window_sec: float = STORY_WINDOW_HOURS * 3600):
+        if num_perm % bands:
+            raise ValueError("STORY_NUM_PERM must be divisible by STORY_BANDS")
+        self.store = store
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.window_sec = window_sec
+        self._masks = _MASKS[:num_perm]
+        self._sigs: dict[str, tuple[int, ...]] = {}    # окно опубликованного: guid -> sig
+        self._ts: dict[str, float] = {}
+        self._buckets: dict[tuple[int, tuple], list[str]] = {}
+        self._sig_cache: dict[str, tuple[int, ...]] = {}
+        self._cycle_buckets: dict = {}   # истории, уже выбранные в текущем цикле
+        self._cycle_sigs: dict = {}
+        self.duplicates = 0
+        self.checked = 0
+
+    async def init(self):
+        rows = await self.store.run(_init_and_load, time.time() - self.window_sec)
+        for guid, ts, blob in rows:
+            sig = tuple(array("Q", blob))
+            if len(sig) == self.num_perm:
+                self._add(guid, sig, self._buckets, self._sigs)
+                self._ts[guid] = ts
+        logging.info(f"Story index loaded {len(self._sigs)} signatures")
+
+    def signature(self, text: str) -> tuple[int, ...]:
+        sh = shingles(text)
+        if not sh:
+            return ()
+        return tuple(min(h ^ m for h in sh) for m in self._masks)
+
+    def _sig_for(self, guid: Optional[str], text: str) -> tuple[int, ...]:
+        if guid and guid in self._sig_cache:
+            return self._sig_cache[guid]
+        sig = self.signature(text)
+        if guid:
+            if len(self._sig_cache) >= SIG_CACHE_ITEMS:
+                self._sig_cache.clear()
+            self._sig_cache[guid] = sig
+        return sig
+
+    def _band_keys(self, sig: tuple[int, ...]):
+        r = self.rows
+        return [(b, sig[b * r:(b + 1) * r]) for b in range(self.bands)]
+
+    def similarity(self, a: tuple[int, ...], b: tuple[int, ...]) -> float:
+        if not a or not b:
+            return 0.0
+        return sum(1 for x, y in zip(a, b) if x == y) / len(a)
+
+    def _match(self, sig, buckets, sigs) -> Optional[str]:
+        seen = set()
+        for key in self._band_keys(sig):
+            for other in buckets.get(key, ()):
+                if other in seen:
+                    continue
+                seen.add(other)
+                if self.similarity(sig, sigs[other]) >= self.threshold:
+                    return other
+        return None
+
+    def _add(self, guid: str, sig: tuple[int, ...], buckets: dict, sigs: dict):
+        if guid in sigs:
+            return
+        sigs[guid] = sig
+        for key in self._band_keys(sig):
+            buckets.setdefault(key, []).append(guid)
+
+    def begin_cycle(self):
+        self.prune()
+        self._cycle_buckets = {}
+        self._cycle_sigs = {}
+
+    def select(self, scored: list, key: Callable, text: Callable) -> list:
+        """Оставить по одному (первому, т.е. лучшему по скору) элементу на историю.
+
+        scored уже отсортирован по убыванию приоритета; key/text достают из
+        элемента guid и очищенный текст заголовок+аннотация. В пределах цикла
+        (begin_cycle) можно звать несколько раз — по мере прихода лент; тогда
+        история остаётся за тем экземпляром, что пришёл первым.
+        """
+        cycle_buckets, cycle_sigs = self._cycle_buckets, self._cycle_sigs
+        out, dups = [], 0
+        for entry in scored:
+            guid = key(entry)
+            sig = self._sig_for(guid, text(entry))
+            self.checked += 1
+            if not sig:
+                out.append(entry)
+                continue
+            twin = self._match(sig, self._buckets, self._sigs)
+            if twin is not None and twin != guid:
+                dups += 1
+                continue
+            if twin is None and self._match(sig, cycle_buckets, cycle_sigs) is not None:
+                dups += 1
+                continue
+            self._add(guid or f"#{len(cycle_sigs)}", sig, cycle_buckets, cycle_sigs)
+            out.append(entry)
+        self.duplicates += dups
+        if dups:
+            logging.info(f"Story clustering: {len(scored)} items -> {len(out)} stories ({dups} near-duplicates)")
+        return out
+
+    async def commit(self, posted: Iterable[tuple[str, str]]):
+        """Запомнить опубликованные истории: (guid, текст)."""
+        now = time.time()
+        rows = []
+        for guid, txt in posted:
+            sig = self._sig_for(guid, txt)
+            if not guid or not sig or guid in self._sigs:
+                continue
+            self._add(guid, sig, self._buckets, self._sigs)
+            self._ts[guid] = now
+            rows.append((guid, now, array("Q", sig).tobytes()))
+        if rows:
+            await self.store.run(_save, rows)
+
+    def claim_bands(self, guid: Optional[str], text: str) -> tuple[list[str], bytes]:
+        """Ключи LSH-корзин и подпись истории для заявки другим процессам (lease.Claim)."""
+        sig = self._sig_for(guid, text)
+        if not sig:
+            return [], b""
+        bands = [f"{b}:{_h64(','.join(map(str, band))):x}" for b, band in self._band_keys(sig)]
+        return bands, array("Q", sig).tobytes()
+
+    def similar_blobs(self, a: bytes, b: bytes) -> bool:
+        return self.similarity(tuple(array("Q", a)), tuple(array("Q", b))) >= self.threshold
+
+    def distinct(self, entries: list, text: Callable, limit: int) -> list:
+        """Первые limit элементов без повторов одной истории (для дайджеста)."""
+        buckets: dict = {}
+        sigs: dict = {}
+        out = []
+        for i, entry in enumerate(entries):
+            sig = self.signature(text(entry))
+            if sig and self._match(sig, buckets, sigs) is not None:
+                continue
+            if sig:
+                self._add(str(i), sig, buckets, sigs)
+            out.append(entry)
+            if len(out) >= limit:
+                break
+        return out
+
+    def prune(self):
+        cutoff = time.time() - self.window_sec
+        stale = [g for g, ts in self._ts.items() if ts < cutoff]
+        if not stale:
+            return
+        for g in stale:
+            del self._sigs[g], self._ts[g]
+        self._buckets = {}
+        for g, sig in self._sigs.items():
+            for key in self._band_keys(sig):
+                self._buckets.setdefault(key, []).append(g)
+
+    async def purge_db(self) -> int:
+        return await self.store.run(_purge, time.time() - self.window_sec)
+
+    def stats(self) -> dict:
+        return {
+            "window_stories": len(self._sigs),
+            "buckets": len(self._buckets),
+            "checked": self.checked,
+            "duplicates": self.duplicates,
+        }
+
+
+def _init_and_load(con: sqlite3.Connection, min_ts: float):
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS story_sig (
+        guid TEXT PRIMARY KEY,
+        ts   REAL,
+        sig  BLOB
+    )
+    """)
+    con.execute("CREATE INDEX IF NOT EXISTS idx_story_sig_ts ON story_sig(ts)")
+    con.commit()
+    return con.execute("SELECT guid, ts, sig FROM story_sig WHERE ts >= ?", (min_ts,)).fetchall()
+
+def _save(con: sqlite3.Connection, rows):
+    with con:
+        con.executemany("INSERT OR REPLACE INTO story_sig (guid, ts, sig) VALUES (?, ?, ?)", rows)
+
+def _purge(con: sqlite3.Connection, min_ts: float) -> int:
+    with con:
+        return con.execute("DELETE FROM story_sig WHERE ts < ?", (min_ts,)).rowcount
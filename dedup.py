@@ -0,0 +1,127 @@
+import os, math, hashlib, logging
+from collections import OrderedDict
+from typing import Iterable
+
+DEDUP_CAPACITY = int(os.getenv("DEDUP_CAPACITY", "200000"))
+DEDUP_FP_RATE = float(os.getenv("DEDUP_FP_RATE", "0.001"))
+DEDUP_LRU_ITEMS = int(os.getenv("DEDUP_LRU_ITEMS", "20000"))
+
+
+def _hash_pair(guid: str) -> tuple[int, int]:
+    d = hashlib.blake2b(guid.encode("utf-8"), digest_size=16).digest()
+    return int.from_bytes(d[:8], "little"), int.from_bytes(d[8:], "little") | 1
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, fp_rate: float):
+        self.capacity = max(1, capacity)
+        self.fp_rate = fp_rate
+        self.m = max(8, int(-self.capacity * math.log(fp_rate) / (math.log(2) ** 2)))
+        self.k = max(1, round(self.m / self.capacity * math.log(2)))
+        self.bits = bytearray((self.m + 7) // 8)
+        self.count = 0
+
+    def _positions(self, h1: int, h2: int):
+        m = self.m
+        return ((h1 + i * h2) % m for i in range(self.k))
+
+    def add_hashed(self, h1: int, h2: int):
+        for p in self._positions(h1, h2):
+            self.bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+    def contains_hashed(self, h1: int, h2: int) -> bool:
+        bits = self.bits
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in self._positions(h1, h2))
+
+    def expected_fp_rate(self) -> float:
+        return (1 - math.exp(-self.k * self.count / self.m)) ** self.k
+
+
+class DedupIndex:
+    """Дедуп перед таблицей posted.
+
+    Bloom-фильтр отвечает «точно новый» без похода в БД, LRU хэшей недавно
+    опубликованных guid — «точно был». Остальные кандидаты подтверждаются
+    одним IN-запросом к posted.
+    """
+
+    def __init__(self, store, capacity: int = DEDUP_CAPACITY, fp_rate: float = DEDUP_FP_RATE,
+                 lru_items: int = DEDUP_LRU_ITEMS):
+        self.store = store
+        self.fp_rate = fp_rate
+        self.lru_items = lru_items
+        self.bloom = BloomFilter(capacity, fp_rate)
+        self._recent: OrderedDict[int, None] = OrderedDict()
+        self.checked = 0
+        self.bloom_negative = 0
+        self.lru_hits = 0
+        self.db_confirmed = 0
+        self.false_positives = 0
+        self.db_queries = 0
+
+    async def warm(self):
+        guids = await self.store.all_posted_guids()
+        capacity = self.bloom.capacity
+        while len(guids) > capacity * 0.8:
+            capacity *= 2
+        self.bloom = BloomFilter(capacity, self.fp_rate)
+        self._recent.clear()
+        for g in guids:
+            self.bloom.add_hashed(*_hash_pair(g))
+        logging.info(f"Dedup index warmed with {len(guids)} guids: {self.stats()}")
+
+    def add(self, guid: str):
+        if not guid:
+            return
+        h1, h2 = _hash_pair(guid)
+        self.bloom.add_hashed(h1, h2)
+        self._remember(h1)
+
+    def _remember(self, h1: int):
+        self._recent[h1] = None
+        self._recent.move_to_end(h1)
+        while len(self._recent) > self.lru_items:
+            self._recent.popitem(last=False)
+
+    async def posted_among(self, guids: Iterable[str]) -> set[str]:
+        """То же, что Store.posted_among, но большинство ответов — без БД."""
+        found, maybe = set(), []
+        for g in guids:
+            if not g:
+                continue
+            self.checked += 1
+            h1, h2 = _hash_pair(g)
+            if not self.bloom.contains_hashed(h1, h2):
+                self.bloom_negative += 1
+            elif h1 in self._recent:
+                self._recent.move_to_end(h1)
+                self.lru_hits += 1
+                found.add(g)
+            else:
+                maybe.append(g)
+        if maybe:
+            self.db_queries += 1
+            confirmed = await self.store.posted_among(maybe)
+            self.db_confirmed += len(confirmed)
+            self.false_positives += len(set(maybe) - confirmed)
+            for g in confirmed:
+                self._remember(_hash_pair(g)[0])
+            found |= confirmed
+        if self.bloom.count > self.bloom.capacity:
+            # фильтр переполнен — FP растёт; пересобираем с запасом из posted
+            await self.warm()
+        return found
+
+    def stats(self) -> dict:
+        new = self.bloom_negative + self.false_positives   # сколько проверок было по новым guid
+        return {
+            "bloom_items": self.bloom.count,
+            "bloom_capacity": self.bloom.capacity,
+            "memory_kb": round((len(self.bloom.bits) + len(self._recent) * 100) / 1024, 1),  # ~100 B на элемент OrderedDict
+            "expected_fp": round(self.bloom.expected_fp_rate(), 6),
+            "observed_fp": round(self.false_positives / new, 6) if new else 0.0,
+            "checked": self.checked,
+            "no_db": self.bloom_negative + self.lru_hits,
+            "db_queries": self.db_queries,
+        }
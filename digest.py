@@ -0,0 +1,109 @@
+import os, re, heapq, time
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, NamedTuple, Optional
+from zoneinfo import ZoneInfo
+
+DIGEST_TZ = os.getenv("DIGEST_TZ", "Europe/Moscow")
+DIGEST_TIMES = os.getenv("DIGEST_TIMES", "08:00,20:00")
+# несколько окон через запятую: "12" или "12,24" — каждое уходит отдельным дайджестом
+DIGEST_LOOKBACK_HOURS = os.getenv("DIGEST_LOOKBACK_HOURS", "12")
+DIGEST_TOP_N = int(os.getenv("DIGEST_TOP_N", "5"))
+DIGEST_HEADROOM = 3   # держим top_n*3: часть отсеется как повторы одной истории
+
+
+class DigestEntry(NamedTuple):
+    urgent: bool
+    priority: float
+    ts: float
+    guid: str
+    link: str
+    headline: str   # уже по-русски и обрезан
+    comment: str
+    text: str       # исходные title+summary — для отсева повторов истории
+
+
+def parse_times(times_str: str) -> list[tuple[int, int]]:
+    out = []
+    for part in times_str.split(","):
+        part = part.strip()
+        if re.match(r"^\d{2}:\d{2}$", part):
+            out.append(tuple(map(int, part.split(":"))))
+    return out
+
+
+class DigestBoard:
+    """Дайджест, который собирается по мере публикации, а не в момент отправки.
+
+    На каждый ближайший запуск (DIGEST_TIMES) и каждое окно (DIGEST_LOOKBACK_HOURS)
+    держим ограниченную min-кучу лучших постов — в порядке старого запроса
+    (urgent, priority, ts). Пост попадает во все запуски, в окно которых он входит.
+    Заголовок и комментарий приходят готовыми из обогащения поста, так что
+    запуск дайджеста — это take() и рендер, без БД и без LLM.
+    """
+
+    def __init__(self, times: str = DIGEST_TIMES, tz: str = DIGEST_TZ,
+                 windows: str = DIGEST_LOOKBACK_HOURS, top_n: int = DIGEST_TOP_N):
+        self.tz = ZoneInfo(tz)
+        self.times = parse_times(times)
+        self.windows = sorted({int(h) for h in str(windows).split(",") if h.strip()}) or [12]
+        self.top_n = top_n
+        self.cap = top_n * DIGEST_HEADROOM
+        self._heaps: dict[tuple[float, int], list[DigestEntry]] = {}   # (fire_ts, hours) -> min-куча
+        self.added = 0
+
+    def fires_between(self, start: float, end: float) -> list[float]:
+        """Моменты запуска в (start, end], epoch-секунды."""
+        if not self.times:
+            return []
+        day = datetime.fromtimestamp(start, self.tz).date()
+        out = []
+        while True:
+            for hh, mm in self.times:
+                f = datetime(day.year, day.month, day.day, hh, mm, tzinfo=self.tz).timestamp()
+                if start < f <= end:
+                    out.append(f)
+            if datetime(day.year, day.month, day.day, tzinfo=self.tz).timestamp() > end:
+                return sorted(out)
+            day += timedelta(days=1)
+
+    def next_fire(self, now: Optional[float] = None) -> float:
+        now = time.time() if now is None else now
+        fires = self.fires_between(now, now + 2 * 86400)
+        return fires[0] if fires else now + 12 * 3600
+
+    def add(self, entry: DigestEntry):
+        self.added += 1
+        for hours in self.windows:
+            for fire in self.fires_between(entry.ts, entry.ts + hours * 3600):
+                heap = self._heaps.setdefault((fire, hours), [])
+                if len(heap) < self.cap:
+                    heapq.heappush(heap, entry)
+                elif entry > heap[0]:
+                    heapq.heapreplace(heap, entry)
+
+    def load(self, entries: Iterable[DigestEntry]):
+        """Восстановление после рестарта (или смены лидера): только то, что ещё войдёт в будущие запуски."""
+        now = time.time()
+        self._heaps.clear()
+        for e in entries:
+            self.add(e)
+        self._drop_before(now)
+
+    def take(self, fire: float) -> dict[int, list[DigestEntry]]:
+        """Кандидаты запуска fire по окнам, лучшие первыми; прошедшие запуски забываем."""
+        out = {hours: sorted(self._heaps.pop((fire, hours), []), reverse=True) for hours in self.windows}
+        self._drop_before(fire)
+        return out
+
+    def _drop_before(self, ts: float):
+        for key in [k for k in self._heaps if k[0] <= ts]:
+            del self._heaps[key]
+
+    def stats(self) -> dict:
+        return {"added": self.added, "fires": len({k[0] for k in self._heaps}),
+                "entries": sum(len(h) for h in self._heaps.values())}
+
+
+def sqlite_ts(ts: str) -> float:
+    """CURRENT_TIMESTAMP SQLite (UTC, без зоны) → epoch."""
+    return datetime.strptime(ts, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc).timestamp()
@@ -0,0 +1,76 @@
+import os, re
+from typing import Optional
+
+# после очистки от HTML длиннее не бывает нужно: скоринг, кластеры и LLM смотрят на начало
+ITEM_SUMMARY_MAX_CHARS = int(os.getenv("ITEM_SUMMARY_MAX_CHARS", "2000"))
+
+_TAG_RE = re.compile(r"<[^>]+>")
+_WS_RE = re.compile(r"\s+")
+_URL_RE = re.compile(r"https?://\S+")
+
+
+def clean_text(s: str) -> str:
+    if not s: return ""
+    s = _TAG_RE.sub(" ", s)
+    s = _WS_RE.sub(" ", s).strip()
+    s = _URL_RE.sub("", s)  # убрать голые URLs
+    return s
+
+def cut(s: str, n: int) -> str:
+    return s if len(s) <= n else s[:n - 3] + "…"
+
+
+class Item:
+    """Элемент ленты между разбором и публикацией.
+
+    Парсер отдаёт dict с сырыми title/summary (часто это HTML в сотни КБ);
+    Item держит их только до первого обращения к title/summary — тогда текст
+    один раз чистится (clean_text), summary обрезается до ITEM_SUMMARY_MAX_CHARS,
+    а сырьё выбрасывается. Скоринг, отсев, кластеры, LLM и рендер поста дальше
+    берут уже очищенные строки, а кэш лент на 304 держит только их.
+    """
+
+    __slots__ = ("guid", "link", "topics", "lang", "_raw", "_title", "_summary")
+
+    def __init__(self, guid: Optional[str], title: str, link: str, summary: str):
+        self.guid = guid
+        self.link = (link or "").strip()
+        self.topics: Optional[frozenset] = None   # темы из скоринга — для эмодзи
+        self.lang: Optional[str] = None
+        self._raw: Optional[tuple[str, str]] = (title or "", summary or "")
+        self._title = ""
+        self._summary = ""
+
+    @classmethod
+    def from_entry(cls, e: dict) -> "Item":
+        return cls(e.get("guid"), e.get("title") or "", e.get("link") or "", e.get("summary") or "")
+
+    def _clean(self):
+        title, summary = self._raw
+        self._title = clean_text(title)
+        self._summary = clean_text(summary)[:ITEM_SUMMARY_MAX_CHARS]
+        self._raw = None
+
+    @property
+    def key(self) -> Optional[str]:
+        return self.guid or self.link or None
+
+    @property
+    def title(self) -> str:
+        if self._raw is not None:
+            self._clean()
+        return self._title
+
+    @property
+    def summary(self) -> str:
+        if self._raw is not None:
+            self._clean()
+        return self._summary
+
+    @property
+    def text(self) -> str:
+        """Заголовок и аннотация одной строкой — для языка и кластеров историй."""
+        return f"{self.title} {self.summary}"
+
+    def __repr__(self):
+        return f"Item({self.key!r}, {self.title[:40]!r})"
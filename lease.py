@@ -0,0 +1,214 @@
+import os, time, sqlite3, asyncio, logging
+from typing import Awaitable, Callable, NamedTuple, Optional
+
+from cluster import STORY_WINDOW_HOURS
+
+LEASE_TTL_SEC = float(os.getenv("LEASE_TTL_SEC", "30"))                  # лидерство без продления
+CLAIM_TTL_HOURS = float(os.getenv("CLAIM_TTL_HOURS", "168"))             # заявка на guid
+
+
+class Claim(NamedTuple):
+    guid: str
+    bands: list[str]   # ключи LSH-корзин подписи истории
+    sig: bytes         # сама подпись — для проверки сходства с чужими заявками
+
+
+class LeaseStore:
+    """Лизы и заявки в общей SQLite — координация процессов-шардов.
+
+    Лиз — именованная запись с владельцем и сроком: взять можно, если он
+    свободен, истёк или уже наш. Заявка на новость — это лиз на её guid плюс
+    подпись истории по LSH-корзинам: повторная заявка на тот же guid или на ту
+    же историю (похожая подпись в любой общей корзине) проигрывает. Пачка заявок
+    проверяется и записывается одной транзакцией BEGIN IMMEDIATE, так что
+    два процесса не могут забрать одно и то же.
+    """
+
+    def __init__(self, store, owner: str):
+        self.store = store
+        self.owner = owner
+        self.claimed = 0
+        self.lost = 0
+
+    async def init(self):
+        await self.store.run(_init)
+
+    async def acquire(self, name: str, ttl: float = LEASE_TTL_SEC) -> bool:
+        return await self.store.run(_acquire, name, self.owner, ttl)
+
+    async def release(self, name: str):
+        await self.store.run(_release, name, self.owner)
+
+    async def claim(self, claims: list[Claim], similar: Callable[[bytes, bytes], bool]) -> list[bool]:
+        """Для каждой заявки: True — новость наша, False — её или её историю уже взял кто-то."""
+        if not claims:
+            return []
+        won = await self.store.run(_claim, claims, similar, self.owner,
+                                   CLAIM_TTL_HOURS * 3600, STORY_WINDOW_HOURS * 3600)
+        n = sum(won)
+        self.claimed += n
+        self.lost += len(won) - n
+        return won
+
+    async def unclaim(self, guids: list[str]):
+        """Снять заявки (чьи угодно): новость так и не ушла — её снова может взять любой шард."""
+        if guids:
+            await self.store.run(_unclaim, guids)
+
+    async def purge(self) -> int:
+        return await self.store.run(_purge)
+
+    def stats(self) -> dict:
+        return {"owner": self.owner, "claimed": self.claimed, "lost": self.lost}
+
+
+class LeaderElection:
+    """Один процесс из всех держит лиз name и продлевает его каждые ttl/3.
+
+    on_change(is_leader) зовётся при каждой смене роли; если лидер пропал,
+    лиз истекает через ttl и его забирает следующий. Роль держится не дольше,
+    чем мог жить последний продлённый лиз: holds() — проверка для отправки.
+    """
+
+    def __init__(self, leases: LeaseStore, name: str = "leader", ttl: float = LEASE_TTL_SEC,
+                 on_change: Optional[Callable[[bool], Awaitable[None]]] = None):
+        self.leases = leases
+        self.name = name
+        self.ttl = ttl
+        self.on_change = on_change
+        self.is_leader = False
+        self.changes = 0
+        self._valid_until = 0.0
+
+    def holds(self) -> bool:
+        """Лидер и наш лиз ещё точно не истёк — можно отправлять."""
+        return self.is_leader and time.monotonic() < self._valid_until
+
+    async def run(self):
+        while True:
+            t0 = time.monotonic()
+            # зависшее продление не должно держать роль: ждём не дольше трети срока
+            # и не дольше, чем живёт уже взятый лиз
+            timeout = self.ttl / 3
+            if self.is_leader:
+                timeout = min(timeout, self._valid_until - t0)
+            try:
+                if timeout <= 0:
+                    raise asyncio.TimeoutError
+                ok = await asyncio.wait_for(self.leases.acquire(self.name, self.ttl), timeout=timeout)
+                if ok:
+                    self._valid_until = t0 + self.ttl
+            except Exception as e:
+                # БД недоступна или занята — держим роль, пока наш лиз не мог истечь
+                logging.warning(f"Lease {self.name} renew failed: {e!r}")
+                ok = self.holds()
+            if ok != self.is_leader:
+                await self._set(ok)
+            delay = self.ttl / 3
+            if self.is_leader:
+                delay = max(0.0, min(delay, self._valid_until - time.monotonic()))
+            await asyncio.sleep(delay)
+
+    async def _set(self, is_leader: bool):
+        self.is_leader = is_leader
+        self.changes += 1
+        logging.info(f"{self.leases.owner}: {'лидер' if is_leader else 'больше не лидер'} ({self.name})")
+        if self.on_change is not None:
+            try:
+                await self.on_change(is_leader)
+            except Exception as e:
+                logging.exception(f"on_change failed: {e}")
+
+    async def resign(self):
+        if self.is_leader:
+            await self._set(False)
+            await self.leases.release(self.name)
+
+    def stats(self) -> dict:
+        return {"name": self.name, "is_leader": self.is_leader, "changes": self.changes}
+
+
+def _init(con: sqlite3.Connection):
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS leases (
+        name    TEXT PRIMARY KEY,
+        owner   TEXT,
+        expires REAL
+    )
+    """)
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS story_claims (
+        band    TEXT,
+        guid    TEXT,
+        owner   TEXT,
+        expires REAL,
+        sig     BLOB,
+        PRIMARY KEY (band, guid)
+    )
+    """)
+    con.execute("CREATE INDEX IF NOT EXISTS idx_story_claims_expires ON story_claims(expires)")
+    con.commit()
+
+def _acquire(con: sqlite3.Connection, name: str, owner: str, ttl: float) -> bool:
+    now = time.time()
+    with con:
+        cur = con.execute("""
+            INSERT INTO leases (name, owner, expires) VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET owner=excluded.owner, expires=excluded.expires
+            WHERE leases.owner=excluded.owner OR leases.expires < ?
+        """, (name, owner, now + ttl, now))
+    return cur.rowcount == 1
+
+def _release(con: sqlite3.Connection, name: str, owner: str):
+    with con:
+        con.execute("DELETE FROM leases WHERE name=? AND owner=?", (name, owner))
+
+def _claim(con: sqlite3.Connection, claims: list[Claim], similar, owner: str,
+           guid_ttl: float, story_ttl: float) -> list[bool]:
+    now = time.time()
+    won = []
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        for c in claims:
+            # заявку на guid не берём повторно даже у себя: опубликованное лидером
+            # в локальный дедуп шарда не попадает, а заявка помнит
+            if con.execute("SELECT 1 FROM leases WHERE name=? AND expires >= ?",
+                           ("guid:" + c.guid, now)).fetchone() is not None:
+                won.append(False)
+                continue
+            twin = False
+            if c.sig:
+                for band in c.bands:
+                    for (sig,) in con.execute("SELECT sig FROM story_claims WHERE band=? AND guid!=? AND expires >= ?",
+                                              (band, c.guid, now)):
+                        if similar(c.sig, sig):
+                            twin = True
+                            break
+                    if twin:
+                        break
+            if twin:
+                won.append(False)
+                continue
+            con.execute("INSERT OR REPLACE INTO leases (name, owner, expires) VALUES (?, ?, ?)",
+                        ("guid:" + c.guid, owner, now + guid_ttl))
+            if c.sig:
+                con.executemany("INSERT OR REPLACE INTO story_claims (band, guid, owner, expires, sig) VALUES (?, ?, ?, ?, ?)",
+                                [(band, c.guid, owner, now + story_ttl, c.sig) for band in c.bands])
+            won.append(True)
+        con.execute("COMMIT")
+    except BaseException:
+        con.execute("ROLLBACK")
+        raise
+    return won
+
+def _unclaim(con: sqlite3.Connection, guids: list[str]):
+    with con:
+        con.executemany("DELETE FROM leases WHERE name=?", [("guid:" + g,) for g in guids])
+        con.executemany("DELETE FROM story_claims WHERE guid=?", [(g,) for g in guids])
+
+def _purge(con: sqlite3.Connection) -> int:
+    now = time.time()
+    with con:
+        n = con.execute("DELETE FROM leases WHERE expires < ?", (now,)).rowcount
+        n += con.execute("DELETE FROM story_claims WHERE expires < ?", (now,)).rowcount
+    return n
@@ -0,0 +1,124 @@
+import os, asyncio, logging, random, time
+from typing import Optional
+
+import aiohttp
+
+from metrics import LLM_CALL_SECONDS
+from net import HttpPool
+
+OPENAI_URL = os.getenv("OPENAI_URL", "https://api.openai.com/v1/chat/completions")
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "4"))
+LLM_TIMEOUT_SEC = float(os.getenv("LLM_TIMEOUT_SEC", "20"))      # на одну попытку
+LLM_DEADLINE_SEC = float(os.getenv("LLM_DEADLINE_SEC", "45"))    # на запрос целиком, с ретраями
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class LLMError(RuntimeError):
+    pass
+
+
+class LLMClient:
+    """Async chat-completions client: pooled session, bounded concurrency, retry with backoff.
+
+    With an HttpPool the client shares the application session; otherwise it opens its own.
+    """
+
+    def __init__(self, api_key: str, url: str = OPENAI_URL, model: str = OPENAI_MODEL,
+                 concurrency: int = LLM_CONCURRENCY, timeout: float = LLM_TIMEOUT_SEC,
+                 deadline: float = LLM_DEADLINE_SEC, max_retries: int = LLM_MAX_RETRIES,
+                 pool: Optional[HttpPool] = None):
+        self.api_key = api_key
+        self.url = url
+        self.model = model
+        self.timeout = timeout
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self._concurrency = max(1, concurrency)
+        self.pool = pool
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self.pool is not None:
+            return self.pool.session()
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self._concurrency * 2, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    def _get_sem(self) -> asyncio.Semaphore:
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self._concurrency)
+        return self._sem
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def chat(self, prompt: str, model: Optional[str] = None, max_tokens: int = 360,
+                   temperature: float = 0.2, deadline: Optional[float] = None) -> str:
+        if not self.api_key:
+            raise LLMError("OPENAI_API_KEY is empty")
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+        }
+        data = {
+            "model": model or self.model,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+        }
+        give_up_at = time.monotonic() + (deadline or self.deadline)
+        attempt = 0
+        while True:
+            remaining = give_up_at - time.monotonic()
+            if remaining <= 0:
+                raise LLMError("LLM deadline exceeded")
+            retry_in = None
+            try:
+                async with self._get_sem():
+                    timeout = aiohttp.ClientTimeout(total=min(self.timeout, remaining))
+                    t0, status = time.perf_counter(), "error"
+                    try:
+                        async with self._get_session().post(self.url, headers=headers, json=data,
+                                                            timeout=timeout) as resp:
+                            status = str(resp.status)
+                            if resp.status in RETRY_STATUSES:
+                                retry_in = _retry_after(resp.headers.get("Retry-After"))
+                                body = (await resp.text())[:200]
+                                err: Exception = LLMError(f"HTTP {resp.status}: {body}")
+                            else:
+                                resp.raise_for_status()
+                                j = await resp.json()
+                                return j["choices"][0]["message"]["content"].strip()
+                    finally:
+                        LLM_CALL_SECONDS.observe(time.perf_counter() - t0, status=status)
+            except (aiohttp.ClientResponseError, KeyError, IndexError, ValueError) as e:
+                # 4xx кроме 429 и кривой JSON — повтор не поможет
+                raise LLMError(f"LLM request failed: {e}") from e
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                err = e
+
+            attempt += 1
+            if attempt > self.max_retries:
+                raise LLMError(f"LLM request failed after {attempt} attempts: {err}") from err
+            if retry_in is None:
+                retry_in = min(2 ** attempt, 30) * random.uniform(0.5, 1.0)
+            if retry_in >= give_up_at - time.monotonic():
+                raise LLMError(f"LLM deadline too close for retry ({retry_in:.1f}s): {err}") from err
+            logging.warning(f"LLM retry {attempt}/{self.max_retries} in {retry_in:.1f}s: {err}")
+            await asyncio.sleep(retry_in)
+
+
+def _retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
@@ -0,0 +1,124 @@
+import os, sys, time, asyncio, logging, threading, traceback
+from collections import Counter
+from typing import Optional
+
+from metrics import LOOP_LAG_SECONDS
+
+LOOP_LAG_THRESHOLD_MS = float(os.getenv("LOOP_LAG_THRESHOLD_MS", "250"))
+LOOP_LAG_INTERVAL_MS = float(os.getenv("LOOP_LAG_INTERVAL_MS", "100"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+
+def format_stack(frame, limit: int = 25) -> str:
+    return "".join(traceback.format_stack(frame, limit=limit))
+
+
+class LoopWatchdog:
+    """Сторож event loop: сердцебиение из loop + поток, который его слушает.
+
+    Корутина раз в interval отмечает время и меряет, насколько опоздал таймер
+    (это и есть лаг). Поток-сторож видит, что отметки нет дольше threshold, и
+    пока loop ещё стоит, снимает стек его потока — то есть ровно того кода,
+    который заблокировал loop. На одну остановку — один стек в лог.
+    """
+
+    def __init__(self, threshold_ms: float = LOOP_LAG_THRESHOLD_MS, interval_ms: float = LOOP_LAG_INTERVAL_MS):
+        self.threshold = threshold_ms / 1000
+        self.interval = interval_ms / 1000
+        self._beat = time.monotonic()
+        self._loop_thread: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.max_lag = 0.0
+        self.stalls = 0
+        self.last_stall: Optional[dict] = None
+
+    async def run(self):
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        try:
+            while True:
+                t0 = time.monotonic()
+                await asyncio.sleep(self.interval)
+                now = time.monotonic()
+                lag = max(0.0, now - t0 - self.interval)
+                self._beat = now
+                self.max_lag = max(self.max_lag, lag)
+                LOOP_LAG_SECONDS.observe(lag)
+        finally:
+            self._stop.set()
+
+    def _watch(self):
+        reported = None
+        while not self._stop.wait(self.threshold / 2):
+            beat = self._beat
+            stalled = time.monotonic() - beat
+            if stalled < self.threshold + self.interval or reported == beat:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            reported = beat
+            self.stalls += 1
+            stack = format_stack(frame)
+            self.last_stall = {"at": time.time(), "stalled_sec": round(stalled, 3), "stack": stack}
+            logging.warning(f"Event loop заблокирован уже {stalled * 1000:.0f} ms, стек:\n{stack}")
+
+    def stats(self) -> dict:
+        return {"max_lag_ms": round(self.max_lag * 1000, 1), "stalls": self.stalls,
+                "threshold_ms": self.threshold * 1000, "last_stall": self.last_stall}
+
+
+class SamplingProfiler:
+    """Семплирующий профайлер всех потоков: раз в interval снимает стеки через sys._current_frames().
+
+    dump() пишет «свёрнутые» стеки (thread;f1;f2;... count) — их понимают
+    flamegraph.pl, speedscope и inferno.
+    """
+
+    def __init__(self, interval_ms: float = PROFILE_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.started = 0.0
+
+    def start(self):
+        self.samples.clear()
+        self._stop.clear()
+        self.started = time.monotonic()
+        self._thread = threading.Thread(target=self._sample, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _sample(self):
+        me = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for t in threading.enumerate():
+                names[t.ident] = t.name
+            for tid, frame in sys._current_frames().items():
+                if tid == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(tid, str(tid)))
+                self.samples[";".join(reversed(stack))] += 1
+
+    def dump(self, path: str) -> str:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, n in self.samples.most_common():
+                f.write(f"{stack} {n}\n")
+        return path
@@ -1,17 +1,37 @@
 # If you see this, previous cell reset the state. Rewriting the file now.
-import os, sys, asyncio, logging, sqlite3, csv, json, re, time, random
-from datetime import datetime, timedelta
-from zoneinfo import ZoneInfo
+import os, sys, asyncio, inspect, logging, csv, json, re, time, heapq
+from collections import deque
+from datetime import datetime
+from typing import Optional
 
-import requests
-import aiohttp, feedparser
+import aiohttp
 from aiohttp import web  # optional tiny HTTP server for Render Web Service
 from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
-from aiogram.filters import CommandStart
+from aiogram.filters import Command, CommandStart
 from aiogram.types import Message
 from aiogram.client.default import DefaultBotProperties
-from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest
+
+from llm import LLMClient
+from net import http
+from storage import Store
+from dedup import DedupIndex
+from cluster import StoryIndex
+from matcher import KeywordMatcher
+from policy import Policy
+from pipeline import Pipeline, PIPELINE_ENRICH_WORKERS, PIPELINE_QUEUE_SIZE
+from batch import MicroBatcher
+from loopwatch import LoopWatchdog, SamplingProfiler, PROFILE_DIR
+from outbox import Outbox
+from lease import LeaseStore, LeaderElection, Claim
+from shard import SHARD_COUNT, SHARD_INDEX, WORKER_ID, owns
+from digest import DigestBoard, DigestEntry, DIGEST_TZ, DIGEST_TOP_N, sqlite_ts
+from cache import LLMCache
+import metrics
+from metrics import tracer, ITEMS, FEED_FETCH_SECONDS, FEED_PARSE_SECONDS
+from scheduler import FeedScheduler
+from parser import parse_pool, stream_entries, PARSE_MAX_ENTRIES
+from item import Item, clean_text, cut
 
 print("MAIN_VERSION=2025-10-31-v3.1", flush=True)
 
@@ -25,36 +45,43 @@ if not BOT_TOKEN:
 if not CHANNEL_ID:
     raise RuntimeError("CHANNEL_ID не задан в Environment.")
 try:
-    CHANNEL_ID = int(CHANNEL_ID)
+    # можно несколько каналов через запятую — у каждого своя очередь и свой лимит
+    CHANNEL_IDS = [int(c) for c in CHANNEL_ID.split(",") if c.strip()]
+    CHANNEL_ID = CHANNEL_IDS[0]
 except Exception:
-    raise RuntimeError("CHANNEL_ID должен быть числом вида -100XXXXXXXXXX")
+    raise RuntimeError("CHANNEL_ID должен быть числом вида -100XXXXXXXXXX (или списком через запятую)")
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "").strip()
 ENABLE_TRANSLATE = os.getenv("ENABLE_TRANSLATE", "1") == "1"
 ENABLE_COMMENT = os.getenv("ENABLE_COMMENT", "1") == "1"   # legacy switch for short comment
 ENABLE_SUMMARY = os.getenv("ENABLE_SUMMARY", "1") == "1"   # NEW: concise summary of the core news
 SUMMARY_MAX_CHARS = int(os.getenv("SUMMARY_MAX_CHARS", "220"))
-
-# Anti-flood controls
-MIN_SECONDS_BETWEEN_POSTS = float(os.getenv("MIN_SECONDS_BETWEEN_POSTS", "1.8"))
+# Пакетное обогащение: перевод заголовка и пересказ для нескольких новостей одним JSON-запросом.
+# 0/1 — по-старому, два запроса на новость. Больше пачка — меньше запросов, но дольше ждёт первая новость.
+LLM_BATCH_SIZE = int(os.getenv("LLM_BATCH_SIZE", "0"))
+LLM_BATCH_WAIT_MS = int(os.getenv("LLM_BATCH_WAIT_MS", "300"))
+LLM_BATCH_TOKENS_PER_ITEM = int(os.getenv("LLM_BATCH_TOKENS_PER_ITEM", "220"))
+
+# Anti-flood controls (темп отправки и flood-wait — в outbox.py)
+# лимит постов за POLL_INTERVAL_SEC (скользящее окно), а не за пачку лент планировщика —
+# ленты опрашиваются вразнобой, и пачек за 10 минут бывает много
 MAX_POSTS_PER_CYCLE = int(os.getenv("MAX_POSTS_PER_CYCLE", "6"))
-RETRY_AFTER_GRACE = int(os.getenv("RETRY_AFTER_GRACE", "2"))
-SLOWDOWN_AFTER_BURST = int(os.getenv("SLOWDOWN_AFTER_BURST", "10"))
+SLOWDOWN_AFTER_BURST = int(os.getenv("SLOWDOWN_AFTER_BURST", "10"))   # пауза после пачки с постами, раз за окно
 
 # Timings & feeds
 DB_PATH = "data.db"
 FEEDS_FILE = "feeds/sources.csv"
-POLL_INTERVAL_SEC = int(os.getenv("POLL_INTERVAL_SEC", "600"))  # 10 минут
+POLL_INTERVAL_SEC = int(os.getenv("POLL_INTERVAL_SEC", "600"))  # 10 минут: интервал лент по умолчанию и окно лимита постов
+FETCH_TIMEOUT_SEC = float(os.getenv("FETCH_TIMEOUT_SEC", "20"))       # на ленту целиком
+FETCH_READ_TIMEOUT_SEC = float(os.getenv("FETCH_READ_TIMEOUT_SEC", "8"))   # тишина между кусками тела
 
 # Digest settings
 ENABLE_DIGEST = os.getenv("ENABLE_DIGEST", "1") == "1"
-DIGEST_TZ = os.getenv("DIGEST_TZ", "Europe/Moscow")
-DIGEST_TIMES = os.getenv("DIGEST_TIMES", "08:00,20:00")
-DIGEST_LOOKBACK_HOURS = int(os.getenv("DIGEST_LOOKBACK_HOURS", "12"))
-DIGEST_TOP_N = int(os.getenv("DIGEST_TOP_N", "5"))
 
 # Optional tiny web server (for Render Web Service)
 BIND_WEB = os.getenv("BIND_WEB", "0") == "1"
+ADMIN_IDS = {int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip()}
+PROFILE_CYCLE = os.getenv("PROFILE_CYCLE", "0") == "1"   # профилировать первый цикл после старта
 PORT = int(os.getenv("PORT", "10000"))
 
 dp = Dispatcher()
@@ -63,60 +90,94 @@ dp = Dispatcher()
 async def start(m: Message):
     await m.answer("🟢 Axed News v3.1: умная ссылкой в заголовке + лаконичный пересказ сути.")
 
+@dp.message(Command("profile"))
+async def cmd_profile(m: Message):
+    if not m.from_user or m.from_user.id not in ADMIN_IDS:
+        return
+    global profile_requested
+    profile_requested = True
+    await m.answer(f"🔬 Следующий цикл будет профилирован, профиль — в {PROFILE_DIR}/")
+
 # === DB ===
-def db_init():
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS posted (
-        guid TEXT PRIMARY KEY,
-        ts   TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )
-    """)
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS items (
-        guid TEXT PRIMARY KEY,
-        ts   TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        title TEXT,
-        summary TEXT,
-        link TEXT,
-        priority REAL DEFAULT 0.0,
-        urgent INTEGER DEFAULT 0
-    )
-    """)
-    con.commit(); con.close()
-
-def was_posted(guid: str) -> bool:
-    if not guid: return False
-    con = sqlite3.connect(DB_PATH); cur = con.cursor()
-    cur.execute("SELECT 1 FROM posted WHERE guid=?", (guid,))
-    row = cur.fetchone(); con.close()
-    return row is not None
-
-def mark_posted_and_store(item: dict, priority: float, urgent: bool):
-    guid = item.get("guid") or item.get("link")
-    if not guid: 
+store = Store(DB_PATH)
+dedup = DedupIndex(store)
+stories = StoryIndex(store)
+policy = Policy()
+digest = DigestBoard()
+RETENTION_INTERVAL_HOURS = float(os.getenv("RETENTION_INTERVAL_HOURS", "24"))
+
+leases = LeaseStore(store, WORKER_ID)
+leader = LeaderElection(leases)
+SHARDED = SHARD_COUNT > 1
+
+async def db_init():
+    await store.init()
+    if SHARDED:
+        await leases.init()
+    await dedup.warm()
+    await stories.init()
+    await outbox.init()
+    await load_digest()
+    policy.set_posted_today(await store.count_posted_since(policy.day_start_utc()))
+    await llm_cache.init()
+    await llm_cache.evict()
+
+def posted_row(item: Item, priority: float, urgent: bool):
+    guid = item.key
+    if not guid:
+        return None
+    return (guid, item.title, item.summary, item.link, priority, urgent)
+
+def digest_entry(row, ts: float) -> DigestEntry:
+    guid, ti, su, ln, pr, urg, *dg = row
+    headline, comment = (list(dg) + [None, None])[:2]
+    ti_c, su_c = clean_text(ti), clean_text(su)
+    return DigestEntry(bool(urg), float(pr), ts, guid, ln or "",
+                       cut(headline or ti_c, 120), cut(comment if comment is not None else su_c, 160),
+                       f"{ti_c} {su_c}")
+
+async def load_digest():
+    rows = await store.read_digest_items(max(digest.windows))
+    digest.load(digest_entry((g, ti, su, ln, pr, urg, hd, cm), sqlite_ts(ts))
+                for g, ts, ti, su, ln, pr, urg, hd, cm in rows)
+    logging.info(f"Digest board: {digest.stats()}")
+
+async def on_delivered(guid: str, meta: dict):
+    """Первая доставка поста в любой из каналов — только теперь он считается опубликованным."""
+    row = meta.get("row")
+    if not row:
         return
-    con = sqlite3.connect(DB_PATH); cur = con.cursor()
-    cur.execute("INSERT OR IGNORE INTO posted (guid) VALUES (?)", (guid,))
-    cur.execute("""INSERT OR REPLACE INTO items (guid, ts, title, summary, link, priority, urgent)
-                   VALUES (?, CURRENT_TIMESTAMP, ?, ?, ?, ?, ?)""",
-                (guid, item.get("title") or "", item.get("summary") or "", item.get("link") or "",
-                 float(priority), 1 if urgent else 0))
-    con.commit(); con.close()
-
-def read_recent_items(hours: int, top_n: int):
-    con = sqlite3.connect(DB_PATH); cur = con.cursor()
-    cur.execute("""SELECT title, summary, link, priority, urgent, ts
-                   FROM items
-                   WHERE ts >= datetime('now', ?)
-                   ORDER BY urgent DESC, priority DESC, ts DESC
-                   LIMIT ?""", (f'-{hours} hours', top_n))
-    rows = cur.fetchall(); con.close()
-    return rows
+    # в дедуп — до первого await: outbox отпускает guid из pending_guids только после нас,
+    # и отсев цикла не должен застать момент, когда guid не виден ни там, ни там
+    dedup.add(guid)
+    await store.mark_posted_many([tuple(row)])
+    await stories.commit([(guid, f"{clean_text(row[1])} {clean_text(row[2])}")])
+    digest.add(digest_entry(row, time.time()))
+    ITEMS.inc(stage="posted")
+
+async def on_failed(guid: str):
+    """Пост не ушёл ни в один канал: снимаем заявку, чтобы новость снова можно было взять."""
+    if SHARDED:
+        await leases.unclaim([guid])
+
+outbox = Outbox(store, on_delivered, shared=SHARDED, on_failed=on_failed, owner=WORKER_ID)
+
+async def retention_loop():
+    while True:
+        try:
+            logging.info(f"DB retention: {await store.retention()}")
+            await llm_cache.evict()
+            await stories.purge_db()
+            await outbox.purge()
+            if SHARDED:
+                await leases.purge()
+        except Exception as e:
+            logging.exception(f"Retention error: {e}")
+        await asyncio.sleep(RETENTION_INTERVAL_HOURS * 3600)
 
 # === FEEDS ===
-def load_feeds() -> list[str]:
+def load_feed_specs() -> list[dict]:
+    """Строки feeds/sources.csv: url и необязательные min_interval/max_interval (сек)."""
     defaults = [
         "https://www.cnbc.com/id/100003114/device/rss/rss.html",
         "https://www.reuters.com/finance/rss",
@@ -125,6 +186,7 @@ def load_feeds() -> list[str]:
         "https://www.moex.com/export/news.aspx?cat=stocks",
         "https://cbr.ru/press/pr/?rss=1",
     ]
+    defaults = [{"url": u} for u in defaults]
     if not os.path.exists(FEEDS_FILE):
         logging.warning("feeds/sources.csv не найден — использую дефолтный пул источников.")
         return defaults
@@ -134,7 +196,17 @@ def load_feeds() -> list[str]:
             r = csv.DictReader(f)
             for row in r:
                 url = (row.get("url") or "").strip()
-                if url: feeds.append(url)
+                if not url: continue
+                spec = {"url": url}
+                for k in ("min_interval", "max_interval"):
+                    v = (row.get(k) or "").strip()
+                    if not v: continue
+                    try:
+                        spec[k] = float(v)
+                    except ValueError:
+                        # опечатка в одной ячейке не должна стоить всего файла
+                        logging.warning(f"{FEEDS_FILE}: {url}: {k}={v!r} не число — беру интервал по умолчанию")
+                feeds.append(spec)
     except Exception as e:
         logging.warning(f"Ошибка чтения {FEEDS_FILE}: {e} — использую дефолтный пул.")
         return defaults
@@ -146,13 +218,6 @@ def detect_lang(text: str) -> str:
     lat = len(re.findall(r"[A-Za-z]", text or ""))
     return "ru" if cyr >= lat else "en"
 
-def clean_text(s: str) -> str:
-    if not s: return ""
-    s = re.sub(r"<[^>]+>", " ", s)
-    s = re.sub(r"\s+", " ", s).strip()
-    s = re.sub(r"https?://\S+", "", s)  # убрать голые URLs
-    return s
-
 PRIORITY_RULES = [
     (["санкц", "sanction", "embargo"], 10, True),
     (["цб", "ставк", "key rate", "фрс", "ecb", "cbr", "rate hike", "rate cut"], 9, True),
@@ -163,51 +228,57 @@ PRIORITY_RULES = [
     (["ipo", "m&a", "acquisition", "сделк", "buyback", "выкуп"], 6, False),
 ]
 
-def compute_priority_and_urgent(title: str, summary: str) -> tuple[float, bool]:
-    text = f"{title} {summary}".lower()
+EMOJI_RULES = [
+    (["цб", "ставк", "фрс", "ecb", "cbr", "регулятор", "rate"], "🏦"),
+    (["инфляц", "ввп", "gdp", "cpi", "pce", "pmi"], "📊"),
+    (["нефть", "brent", "gas", "газ", "energy"], "🛢️"),
+    (["акци", "индекс", "s&p", "nasdaq", "moex", "риск"], "📈"),
+]
+
+# один проход по тексту на все словари: скоринг и эмодзи считаются из одного набора хитов
+topic_matcher = KeywordMatcher([k for kws, _, _ in PRIORITY_RULES for k in kws] +
+                               [k for kws, _ in EMOJI_RULES for k in kws])
+
+def topic_hits(title: str, summary: str) -> frozenset:
+    return topic_matcher.hits(f"{title} {summary}".lower())
+
+def compute_priority_and_urgent(title: str, summary: str, hits: frozenset | None = None) -> tuple[float, bool]:
+    hits = topic_hits(title, summary) if hits is None else hits
     score = 0.0
     urgent = False
     for kws, base, is_urgent in PRIORITY_RULES:
-        if any(k in text for k in kws):
+        if not hits.isdisjoint(kws):
             score += base
             urgent = urgent or is_urgent
     score += min(len(summary) / 500.0, 2.0)
     return score, urgent
 
-def pick_emoji(title: str, summary: str, urgent: bool) -> str:
+def pick_emoji(title: str, summary: str, urgent: bool, hits: frozenset | None = None) -> str:
     if urgent:
         return "🚨"
-    txt = f"{title} {summary}".lower()
-    if any(k in txt for k in ["цб", "ставк", "фрс", "ecb", "cbr", "регулятор", "rate"]):
-        return "🏦"
-    if any(k in txt for k in ["инфляц", "ввп", "gdp", "cpi", "pce", "pmi"]):
-        return "📊"
-    if any(k in txt for k in ["нефть", "brent", "gas", "газ", "energy"]):
-        return "🛢️"
-    if any(k in txt for k in ["акци", "индекс", "s&p", "nasdaq", "moex", "риск"]):
-        return "📈"
+    hits = topic_hits(title, summary) if hits is None else hits
+    for kws, emoji in EMOJI_RULES:
+        if not hits.isdisjoint(kws):
+            return emoji
     return "📰"
 
-def openai_chat(prompt: str, model: str = "gpt-4o-mini") -> str:
-    if not OPENAI_API_KEY:
-        raise RuntimeError("OPENAI_API_KEY is empty")
-    url = "https://api.openai.com/v1/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {OPENAI_API_KEY}",
-        "Content-Type": "application/json",
-    }
-    data = {
-        "model": model,
-        "messages": [{"role": "user", "content": prompt}],
-        "temperature": 0.2,
-        "max_tokens": 360,
-    }
-    resp = requests.post(url, headers=headers, data=json.dumps(data), timeout=20)
-    resp.raise_for_status()
-    j = resp.json()
-    return j["choices"][0]["message"]["content"].strip()
-
-def translate_ru(text: str) -> str:
+llm = LLMClient(OPENAI_API_KEY, pool=http)
+llm_cache = LLMCache(store)
+
+async def openai_chat(prompt: str, model: str | None = None, max_tokens: int = 360) -> str:
+    return await llm.chat(prompt, model=model, max_tokens=max_tokens)
+
+async def cached_chat(kind: str, key_text: str, prompt: str, max_chars: int = 0) -> str:
+    key = llm_cache.make_key(kind, key_text, llm.model, max_chars)
+    hit = await llm_cache.get(key)
+    if hit is not None:
+        return hit
+    t0 = time.monotonic()
+    out = await openai_chat(prompt)
+    await llm_cache.put(key, out, time.monotonic() - t0)
+    return out
+
+async def translate_ru(text: str) -> str:
     if not text:
         return ""
     if not ENABLE_TRANSLATE or not OPENAI_API_KEY:
@@ -217,14 +288,18 @@ def translate_ru(text: str) -> str:
         "Без кавычек и ссылок:\n\n" + text
     )
     try:
-        return openai_chat(prompt)
-    except Exception:
+        return await cached_chat("tr", text, prompt, 160)
+    except Exception as e:
+        logging.warning(f"translate_ru failed: {e}")
         return text
 
-def concise_summary(title: str, summary: str, link: str) -> str:
+def summary_fallback(title: str, summary: str) -> str:
     base = clean_text(summary) or clean_text(title)
+    return (base[:SUMMARY_MAX_CHARS] + "…") if len(base) > SUMMARY_MAX_CHARS else base
+
+async def concise_summary(title: str, summary: str, link: str) -> str:
     if not ENABLE_SUMMARY or not OPENAI_API_KEY:
-        return (base[:SUMMARY_MAX_CHARS] + "…") if len(base) > SUMMARY_MAX_CHARS else base
+        return summary_fallback(title, summary)
     prompt = (
         f"Сжато перескажи суть новости (1–2 предложения, до {SUMMARY_MAX_CHARS} символов), "
         "живым деловым тоном, без клише, без слова 'AI-анализ', без ссылок, без HTML. "
@@ -232,13 +307,93 @@ def concise_summary(title: str, summary: str, link: str) -> str:
         f"Заголовок: {title}\nАннотация: {summary}\nURL: {link}"
     )
     try:
-        txt = openai_chat(prompt)
+        # ссылку в ключ не берём: одна и та же история из разных лент должна попадать в кэш
+        txt = await cached_chat("sum", f"{title}\n{summary}", prompt, SUMMARY_MAX_CHARS)
         txt = clean_text(txt)
         if len(txt) > SUMMARY_MAX_CHARS:
             txt = txt[:SUMMARY_MAX_CHARS - 1] + "…"
         return txt
-    except Exception:
-        return (base[:SUMMARY_MAX_CHARS] + "…") if len(base) > SUMMARY_MAX_CHARS else base
+    except Exception as e:
+        logging.warning(f"concise_summary failed: {e}")
+        return summary_fallback(title, summary)
+
+def parse_batch_reply(text: str, n: int) -> dict[int, tuple[str, str]]:
+    """{id: (title_ru, summary)} из ответа модели; кривые и пропущенные элементы просто отсутствуют."""
+    text = (text or "").strip()
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end < start:
+        return {}
+    try:
+        data = json.loads(text[start:end + 1])
+    except ValueError:
+        return {}
+    out = {}
+    for it in (data.get("items") if isinstance(data, dict) else None) or []:
+        if not isinstance(it, dict):
+            continue
+        i, title_ru, core = it.get("id"), it.get("title_ru"), it.get("summary")
+        if not isinstance(i, int) or not 0 <= i < n or not isinstance(title_ru, str) or not isinstance(core, str):
+            continue
+        title_ru, core = clean_text(title_ru), clean_text(core)
+        if not title_ru or not core:
+            continue
+        out[i] = (title_ru, cut(core, SUMMARY_MAX_CHARS))
+    return out
+
+async def localize_batch(items: list[tuple[str, str, str]]) -> list[tuple[str, str] | None]:
+    """Перевод заголовка и пересказ для пачки (title, summary, lang) одним запросом.
+
+    None — элемент не разобрался, для него localize() берёт обычный запасной путь.
+    """
+    payload = [{"id": i, "title": t, "summary": cut(s, 1200)} for i, (t, s, _) in enumerate(items)]
+    prompt = (
+        "Для каждой новости из JSON-массива ниже верни JSON-объект "
+        '{"items": [{"id": <id>, "title_ru": "...", "summary": "..."}]} — по элементу на каждую новость.\n'
+        "title_ru — заголовок на русском, литературно и сжато, максимум 160 символов, без кавычек и ссылок "
+        "(если заголовок уже на русском — оставь как есть).\n"
+        f"summary — суть новости по-русски, 1–2 предложения, до {SUMMARY_MAX_CHARS} символов, живым деловым тоном, "
+        "без клише, без слова 'AI-анализ', без ссылок, без HTML. Если есть цифры/сроки — включи их. "
+        "Фокус: влияние на рынки/экономику/рубль/акции.\n"
+        "Ответ — только JSON, без пояснений.\n\n" + json.dumps(payload, ensure_ascii=False)
+    )
+    t0 = time.monotonic()
+    reply = await openai_chat(prompt, max_tokens=LLM_BATCH_TOKENS_PER_ITEM * len(items) + 60)
+    per_item = (time.monotonic() - t0) / len(items)
+    parsed = parse_batch_reply(reply, len(items))
+    if len(parsed) < len(items):
+        logging.warning(f"LLM batch: {len(items) - len(parsed)}/{len(items)} items unparsed — fallback")
+    out = []
+    for i, (title, summary, lang) in enumerate(items):
+        if i not in parsed:
+            out.append(None)
+            continue
+        title_ru, core = parsed[i]
+        # те же ключи, что у translate_ru/concise_summary — кэш общий для обоих режимов
+        if lang != "ru" and ENABLE_TRANSLATE:
+            await llm_cache.put(llm_cache.make_key("tr", title, llm.model, 160), title_ru, per_item)
+        await llm_cache.put(llm_cache.make_key("sum", f"{title}\n{summary}", llm.model, SUMMARY_MAX_CHARS), core, per_item)
+        out.append((title_ru if lang != "ru" and ENABLE_TRANSLATE else title, core))
+    return out
+
+# пачка имеет смысл только с пересказом: без него остаётся один перевод заголовка
+llm_batcher = (MicroBatcher(localize_batch, LLM_BATCH_SIZE, LLM_BATCH_WAIT_MS / 1000)
+               if LLM_BATCH_SIZE > 1 and ENABLE_SUMMARY and OPENAI_API_KEY else None)
+
+async def localize_batched(title: str, summary: str, lang: str) -> tuple[str, str]:
+    need_tr = lang != "ru" and ENABLE_TRANSLATE
+    cached_core = await llm_cache.get(llm_cache.make_key("sum", f"{title}\n{summary}", llm.model, SUMMARY_MAX_CHARS))
+    cached_title = (await llm_cache.get(llm_cache.make_key("tr", title, llm.model, 160))) if need_tr else title
+    if cached_core is not None and cached_title is not None:
+        return cached_title, cached_core
+    try:
+        res = await llm_batcher.submit((title, summary, lang))
+    except Exception as e:
+        logging.warning(f"localize batch failed: {e}")
+        res = None
+    if res is None:
+        # тот же запасной путь, что у translate_ru/concise_summary при ошибке
+        return title, summary_fallback(title, summary)
+    return res
 
 KEYWORDS_FOR_LINK = [
     "ФРС","ECB","ЕЦБ","ЦБ","ЦБР","Минфин","РФ","Рубль","Рынки","Рынок","Нефть","Brent",
@@ -246,13 +401,15 @@ KEYWORDS_FOR_LINK = [
     "Nasdaq","S&P","Dow","EU","UK","Япония","Канада","Индия","Казахстан"
 ]
 
+link_matcher = KeywordMatcher(KEYWORDS_FOR_LINK, boundary=r"[A-Яа-яA-Za-z0-9]")
+
 def linkify_in_title(title_ru: str, link: str) -> str:
     if not link or not title_ru:
         return title_ru
-    for kw in KEYWORDS_FOR_LINK:
-        pattern = r'(?<![A-Яа-яA-Za-z0-9])(' + re.escape(kw) + r')(?![A-Яа-яA-Za-z0-9])'
-        if re.search(pattern, title_ru):
-            return re.sub(pattern, rf'<a href="{link}">\1</a>', title_ru, count=1)
+    # первое по порядку KEYWORDS_FOR_LINK слово, найденное целиком, — первое его вхождение
+    m = link_matcher.first(title_ru)
+    if m is not None:
+        return f'{title_ru[:m.start(1)]}<a href="{link}">{m.group(1)}</a>{title_ru[m.end(1):]}'
     tokens = title_ru.split()
     for i, t in enumerate(tokens):
         if len(re.sub(r"[^A-Za-zА-Яа-яЁё0-9]", "", t)) >= 4:
@@ -260,31 +417,23 @@ def linkify_in_title(title_ru: str, link: str) -> str:
             return " ".join(tokens)
     return f'<a href="{link}">{title_ru}</a>'
 
-def format_post(item: dict, priority: float, urgent: bool) -> str:
-    title = clean_text(item.get("title") or "")
-    link = (item.get("link") or "").strip()
-    summary = clean_text(item.get("summary") or "")
-
-    lang = detect_lang(f"{title} {summary}")
+async def localize(item: Item) -> tuple[str, str]:
+    """(заголовок по-русски, лаконичный пересказ) — общие для поста и дайджеста."""
+    title, link, summary = item.title, item.link, item.summary
+    lang = item_lang(item)
+    if llm_batcher is not None:
+        return await localize_batched(title, summary, lang)
     if lang != "ru":
-        title_ru = translate_ru(title)
-    else:
-        title_ru = title
-
-    title_linked = linkify_in_title(title_ru, link)
-    core = concise_summary(title, summary, link)
-
-    emoji = "🚨" if urgent else "📰"
-    if not urgent:
-        txt = (title + " " + summary).lower()
-        if any(k in txt for k in ["цб","ставк","фрс","ecb","cbr","регулятор","rate"]):
-            emoji = "🏦"
-        elif any(k in txt for k in ["инфляц","ввп","gdp","cpi","pce","pmi"]):
-            emoji = "📊"
-        elif any(k in txt for k in ["нефть","brent","gas","газ","energy"]):
-            emoji = "🛢️"
-        elif any(k in txt for k in ["акци","индекс","s&p","nasdaq","moex","риск"]):
-            emoji = "📈"
+        # перевод и пересказ независимы — гоняем параллельно
+        return tuple(await asyncio.gather(translate_ru(title), concise_summary(title, summary, link)))
+    return title, await concise_summary(title, summary, link)
+
+async def format_post(item: Item, priority: float, urgent: bool) -> str:
+    return render_post(item, urgent, *await localize(item))
+
+def render_post(item: Item, urgent: bool, title_ru: str, core: str) -> str:
+    title_linked = linkify_in_title(title_ru, item.link)
+    emoji = pick_emoji(item.title, item.summary, urgent, item.topics)
 
     lines = []
     if title_linked:
@@ -293,148 +442,350 @@ def format_post(item: dict, priority: float, urgent: bool) -> str:
         lines.append(f"• {core}")
     return "\n".join(lines).strip()
 
-_last_send_ts = 0.0
-
-async def safe_send_message(bot: Bot, chat_id: int, text: str) -> bool:
-    global _last_send_ts
-    elapsed = time.time() - _last_send_ts
-    if elapsed < MIN_SECONDS_BETWEEN_POSTS:
-        await asyncio.sleep(MIN_SECONDS_BETWEEN_POSTS - elapsed)
-
+_feed_states: dict[str, dict] | None = None
+_feed_items: dict[str, list[Item]] = {}   # последние распарсенные элементы ленты — отдаём их на 304
+_feed_latency: dict[str, tuple[float, str]] = {}   # url -> (секунды последнего опроса, outcome) для /debug/stats
+
+async def fetch_feed(session: aiohttp.ClientSession, url: str, state: dict | None = None):
+    """Условный GET и потоковый разбор: на 304 возвращаем прошлые элементы, иначе читаем тело
+    кусками и бросаем загрузку, как только дошли до уже виденного guid или до PARSE_MAX_ENTRIES.
+
+    В state (строка feed_state) пишется outcome: parsed / not_modified / unchanged / error.
+    """
+    state = state if state is not None else {}
+    cached = _feed_items.get(url)
+    # gzip/deflate распаковываем сами, чтобы ограничивать размер уже распакованного тела
+    headers = {"Accept-Encoding": "gzip, deflate"}
+    # без распарсенных элементов (например, после рестарта) 304 нам бесполезен
+    if cached is not None:
+        if state.get("etag"):
+            headers["If-None-Match"] = state["etag"]
+        if state.get("last_modified"):
+            headers["If-Modified-Since"] = state["last_modified"]
+    # last_guid обрезает ленту только при живом кэше: после рестарта виденное, но не
+    # опубликованное (ночь вне hours_window, лимиты, ждавшее LLM) иначе пропало бы; опубликованное отсеет dedup
+    last_guid = state.get("last_guid") if cached is not None else None
+    timeout = aiohttp.ClientTimeout(total=FETCH_TIMEOUT_SEC, sock_read=FETCH_READ_TIMEOUT_SEC)
     try:
-        await bot.send_message(chat_id=chat_id, text=text, disable_web_page_preview=False)
-        _last_send_ts = time.time()
-        return True
-
-    except TelegramRetryAfter as e:
-        wait_s = int(getattr(e, "retry_after", 5)) + RETRY_AFTER_GRACE
-        logging.warning(f"Flood limit: retry after {wait_s}s")
-        await asyncio.sleep(wait_s)
-        try:
-            await bot.send_message(chat_id=chat_id, text=text, disable_web_page_preview=False)
-            _last_send_ts = time.time()
-            return True
-        except Exception as e2:
-            logging.exception(f"Retry after failed: {e2}")
-            return False
-
-    except (TelegramForbiddenError, TelegramBadRequest) as e:
-        logging.exception(f"Send failed (forbidden/bad request): {e}")
-        return False
-
+        async with session.get(url, headers=headers, timeout=timeout, auto_decompress=False) as resp:
+            if resp.status == 304 and cached is not None:
+                state.update(outcome="not_modified", last_success=time.time(), failures=0)
+                return cached
+            resp.raise_for_status()
+            state["etag"] = resp.headers.get("ETag")
+            state["last_modified"] = resp.headers.get("Last-Modified")
+            stream = await stream_entries(resp, last_guid)
+        state.update(last_success=time.time(), failures=0)
+        if stream.truncated:
+            logging.warning(f"Лента {url} больше лимита — прочитано {len(stream.body)} байт")
+        if stream.fallback:
+            # невалидный XML — старый путь: feedparser по (ограниченному) телу в пуле
+            new_items, parse_sec = await parse_pool.parse(bytes(stream.body), last_guid)
+        else:
+            new_items, parse_sec = stream.items, stream.parse_sec
+        new_items = [Item.from_entry(e) for e in new_items]
+        FEED_PARSE_SECONDS.observe(parse_sec)
+        # сверху лежит уже виденный guid — новых нет, дочитывать и перепарсивать нечего
+        state.update(outcome="parsed" if new_items or cached is None else "unchanged",
+                     parse_sec=parse_sec, read_bytes=len(stream.body))
+        if new_items:
+            state["last_guid"] = new_items[0].guid
+        fresh = {it.guid for it in new_items}
+        items = (new_items + [it for it in (cached or []) if it.guid not in fresh])[:PARSE_MAX_ENTRIES]
+        _feed_items[url] = items
+        return items
     except Exception as e:
-        logging.exception(f"Send failed (generic): {e}")
-        return False
+        state.update(outcome="error", failures=(state.get("failures") or 0) + 1)
+        logging.warning(f"Ошибка ленты {url}: {e!r}")
+        return []
 
-async def post_to_channel(bot: Bot, channel_id: int, item: dict, priority: float, urgent: bool) -> bool:
-    return await safe_send_message(bot, channel_id, format_post(item, priority, urgent))
+async def fetch_all(urls: list[str], on_feed=None):
+    """on_feed(url, items, ok) вызывается по каждой ленте сразу, как она скачана (может быть корутиной).
+
+    Так планировщик узнаёт результат опроса, а конвейер получает элементы, не дожидаясь самой медленной ленты.
+    """
+    global _feed_states
+    if _feed_states is None:
+        _feed_states = await store.load_feed_states()
+    states = {u: _feed_states.setdefault(u, {}) for u in urls}
+    out = []
+
+    async def one(session, u):
+        t0 = time.perf_counter()
+        with tracer.span("fetch"):
+            r = await fetch_feed(session, u, states[u])
+        dt, outcome = time.perf_counter() - t0, states[u].get("outcome", "error")
+        FEED_FETCH_SECONDS.observe(dt, outcome=outcome)
+        _feed_latency[u] = (round(dt, 3), outcome)
+        out.extend(r)
+        if on_feed is not None:
+            res = on_feed(u, r, states[u].get("outcome") != "error")
+            if inspect.isawaitable(res):
+                await res
+
+    session = http.session()
+    results = await asyncio.gather(*(one(session, u) for u in urls), return_exceptions=True)
+    for r in results:
+        if isinstance(r, Exception):
+            logging.error(f"on_feed failed: {r!r}")
+    outcomes = {}
+    parse_total, slowest, read_total = 0.0, (0.0, ""), 0
+    for u, st in states.items():
+        k = st.pop("outcome", "error")
+        outcomes[k] = outcomes.get(k, 0) + 1
+        read_total += st.pop("read_bytes", 0)
+        parse_sec = st.pop("parse_sec", 0.0)
+        parse_total += parse_sec
+        slowest = max(slowest, (parse_sec, u))
+    with tracer.span("save_feed_states"):
+        await store.save_feed_states(states)
+    logging.info(f"Feeds re-parsed {outcomes.get('parsed', 0)}/{len(urls)} "
+                 f"(not_modified={outcomes.get('not_modified', 0)}, unchanged={outcomes.get('unchanged', 0)}, "
+                 f"errors={outcomes.get('error', 0)}), read {read_total // 1024} KB, parse {parse_total * 1000:.0f} ms"
+                 + (f", slowest {slowest[1]} {slowest[0] * 1000:.0f} ms" if slowest[0] > 0 else ""))
+    return out
+
+def item_lang(it: Item) -> str:
+    if it.lang is None:
+        it.lang = detect_lang(it.text)
+    return it.lang
+
+def score_item(it: Item) -> tuple[float, bool, Item]:
+    it.topics = topic_hits(it.title, it.summary)   # пригодится format_post для эмодзи
+    pr, urg = compute_priority_and_urgent(it.title, it.summary, it.topics)
+    return pr, urg, it
+
+def rank_scored(scored: list, k: Optional[int] = None) -> list[tuple[float, bool, Item]]:
+    """Срочные впереди, дальше по приоритету; k — только k лучших (куча вместо полной сортировки)."""
+    key = lambda x: (x[1], x[0])
+    if k is not None and k < len(scored):
+        return heapq.nlargest(k, scored, key=key)
+    scored.sort(key=key, reverse=True)
+    return scored
 
-async def fetch_feed(session: aiohttp.ClientSession, url: str):
-    try:
-        async with session.get(url, timeout=aiohttp.ClientTimeout(total=20)) as resp:
-            content = await resp.read()
-            feed = feedparser.parse(content)
-            items = []
-            for e in feed.entries[:12]:
-                items.append({
-                    "guid": e.get("id") or e.get("guid") or e.get("link"),
-                    "title": (e.get("title") or "").strip(),
-                    "link": (e.get("link") or "").strip(),
-                    "summary": (e.get("summary") or e.get("description") or "").strip(),
-                })
-            return items
-    except Exception as e:
-        logging.warning(f"Ошибка ленты {url}: {e}")
-        return []
+def score_items(items: list[Item], k: Optional[int] = None) -> list[tuple[float, bool, Item]]:
+    return rank_scored([score_item(it) for it in items], k)
 
-async def fetch_all(urls: list[str]):
-    async with aiohttp.ClientSession() as session:
-        tasks = [fetch_feed(session, u) for u in urls]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        out = []
-        for r in results:
-            if isinstance(r, list):
-                out.extend(r)
-        return out
-
-async def fetch_all_and_score(feeds: list[str]):
-    items = await fetch_all(feeds)
+async def fetch_all_and_score(feeds: list[str], on_feed=None, k: Optional[int] = None):
     scored = []
-    for it in items:
-        title = clean_text(it.get("title") or "")
-        summary = clean_text(it.get("summary") or "")
-        pr, urg = compute_priority_and_urgent(title, summary)
-        scored.append((pr, urg, it))
-    scored.sort(key=lambda x: (x[1], x[0]), reverse=True)
-    return scored
+
+    async def score(url, items, ok):
+        # скорим ленту сразу по приходу: её сырой HTML выбрасывается до разбора следующих
+        scored.extend(score_item(it) for it in items)
+        if on_feed is not None:
+            res = on_feed(url, items, ok)
+            if inspect.isawaitable(res):
+                await res
+
+    await fetch_all(feeds, score)
+    return rank_scored(scored, k)
+
+async def admit_items(scored: list, seen: set) -> list:
+    """Отсев свежескачанной пачки: уже опубликованное, политика config.json, дубли историй.
+
+    seen — guid, уже встреченные в этом цикле (одна новость бывает в нескольких лентах).
+    """
+    n = len(scored)
+    scored = [e for e in scored if e[2].key not in seen]
+    seen.update(e[2].key for e in scored)
+    # bloom отсекает заведомо новые, остальное — одним IN-запросом
+    already = await dedup.posted_among(it.key for _, _, it in scored)
+    ITEMS.inc(n - len(scored) + len(already), stage="deduped")
+    kept = []
+    for e in scored:
+        if e[2].key in already:
+            continue
+        # config.json: дешёвый отсев до кластеризации и любых LLM-вызовов
+        reason = policy.check(e[2].title, e[2].summary, item_lang(e[2]), e[0])
+        if reason:
+            policy.drop(reason, e[2].key)
+            ITEMS.inc(stage="filtered")
+        else:
+            kept.append(e)
+    # одна история из нескольких лент — оставляем один экземпляр
+    out = stories.select(kept, key=lambda e: e[2].key, text=lambda e: e[2].text)
+    ITEMS.inc(len(kept) - len(out), stage="story_dup")
+    ITEMS.inc(len(out), stage="admitted")
+    return out
+
+def cap_cycle(entries: list, admitted: int, limit: int) -> tuple[list, list]:
+    """(что уходит в конвейер, что ждёт следующего цикла) при admitted уже взятых в этом цикле."""
+    n = max(0, limit - admitted)
+    return entries[:n], entries[n:]
+
+async def claim_items(entries: list) -> list:
+    """SHARD_COUNT > 1: заявки на то, что уходит в конвейер; остаётся то, что не взял другой шард.
+
+    Заявляем только после лимитов — отложенное до следующего цикла заявку не держит.
+    """
+    if not SHARDED or not entries:
+        return entries
+    # тот же guid или та же история могли прийти другому шарду из его лент
+    claims = [Claim(e[2].key, *stories.claim_bands(e[2].key, e[2].text)) for e in entries]
+    won = await leases.claim(claims, stories.similar_blobs)
+    ITEMS.inc(len(entries) - sum(won), stage="claimed_elsewhere")
+    return [e for e, ok in zip(entries, won) if ok]
+
+_posts_window: deque = deque()   # monotonic-время постов, ушедших в конвейер за последние POLL_INTERVAL_SEC
+
+def posts_left_in_window(now: float) -> int:
+    while _posts_window and _posts_window[0] <= now - POLL_INTERVAL_SEC:
+        _posts_window.popleft()
+    return max(0, MAX_POSTS_PER_CYCLE - len(_posts_window))
+
+async def enqueue_post(it: Item, priority: float, urgent: bool, text: str, title_ru: str, core: str):
+    """В outbox, во все каналы; posted отметится при первой доставке.
+
+    Русские заголовок и пересказ едут с постом — дайджест их не переводит заново.
+    """
+    row = posted_row(it, priority, urgent)
+    if row:
+        row = (*row, cut(title_ru, 120), cut(core, 160))
+    await outbox.enqueue(CHANNEL_IDS, text, lane="urgent" if urgent else "regular",
+                         guid=row and row[0], meta={"row": row})
+    if SHARDED and row:
+        # доставку отмечает лидер в своём процессе; шард, который пост поставил,
+        # сам помнит его опубликованным — иначе каждый цикл брал бы его снова
+        dedup.add(row[0])
 
 async def worker_loop(bot: Bot):
-    feeds = load_feeds()
-    if not feeds:
+    specs = load_feed_specs()
+    if SHARDED:
+        n = len(specs)
+        specs = [s for s in specs if owns(s["url"])]
+        logging.info(f"Shard {SHARD_INDEX}/{SHARD_COUNT} ({WORKER_ID}): {len(specs)} of {n} feeds")
+    if not specs:
         logging.warning("Нет источников — добавь feeds/sources.csv или используй дефолтный список.")
+    scheduler = FeedScheduler(specs)
+    metrics.sources["scheduler"] = scheduler.stats
+    metrics.gauges["feeds"] = lambda: len(scheduler)
+    last_slowdown = float("-inf")
     while True:
+        await asyncio.sleep(scheduler.seconds_until_next())
+        due = scheduler.pop_due()
+        reported = set()
+
+        fetched = 0
+        seen: set = set()
+        queued = 0
+        policy.maybe_reload()
+        stories.begin_cycle()
+        open_window = policy.in_hours()
+        limit = posts_left_in_window(time.monotonic())
+        left_today = policy.posts_left_today()
+        if left_today is not None and left_today < limit:
+            limit = left_today
+            logging.info(f"max_posts_per_day: {left_today} posts left today")
+        admitted = 0
+        waiting = 0
+        unsent: set = set()   # заявлено в этом цикле, но ещё не в outbox
+        candidates: list = []   # не срочное со всех лент пачки — в конвейер лучшие по приоритету
+
+        async def enrich(entry):
+            pr, urg, it = entry
+            with tracer.span("enrich"):
+                title_ru, core = await localize(it)
+            return render_post(it, urg, title_ru, core), title_ru, core
+
+        async def send(entry, enriched):
+            nonlocal queued
+            pr, urg, it = entry
+            with tracer.span("enqueue"):
+                await enqueue_post(it, pr, urg, *enriched)
+            unsent.discard(it.key)
+            policy.note_posted()
+            queued += 1
+
+        async def on_feed(url, items, ok):
+            nonlocal fetched
+            reported.add(url)
+            scheduler.report(url, [it.key for it in items], ok)
+            fetched += len(items)
+            ITEMS.inc(len(items), stage="fetched")
+            if not items or not open_window:
+                return
+            # то, что уже стоит в outbox, повторно не обрабатываем
+            seen.update(outbox.pending_guids())
+            with tracer.span("admit"):
+                admitted_now = await admit_items(score_items(items), seen)
+            # срочное — сразу и вперёд очереди, но в пределах того же лимита
+            await take([e for e in admitted_now if e[1]])
+            candidates.extend(e for e in admitted_now if not e[1])
+
+        async def take(entries: list):
+            nonlocal admitted, waiting
+            while entries and admitted < limit:
+                batch, entries = cap_cycle(entries, admitted, limit)
+                # места резервируем до await: ленты разбираются параллельно;
+                # проигранные заявки освобождают места следующим по очереди
+                admitted += len(batch)
+                won = await claim_items(batch)
+                admitted -= len(batch) - len(won)
+                for e in won:
+                    pr, urg, it = e
+                    if SHARDED:
+                        unsent.add(it.key)
+                    _posts_window.append(time.monotonic())
+                    await pipe.submit((0 if urg else 1, -pr), e)
+            waiting += len(entries)
+
+        global profile_requested
+        profiler = None
+        if profile_requested:
+            profile_requested = False
+            profiler = SamplingProfiler()
+            profiler.start()
         try:
-            logging.info("Fetching feeds...")
-            scored = await fetch_all_and_score(feeds)
-            logging.info(f"Fetched {len(scored)} items (sorted by priority)")
-            posted = 0
-            for pr, urg, it in scored:
-                if posted >= MAX_POSTS_PER_CYCLE:
-                    logging.info(f"Reached MAX_POSTS_PER_CYCLE={MAX_POSTS_PER_CYCLE}, breaking this cycle")
-                    break
-
-                guid = it.get("guid") or it.get("link")
-                if was_posted(guid):
-                    continue
-
-                ok = await post_to_channel(bot, CHANNEL_ID, it, pr, urg)
-                if ok:
-                    posted += 1
-                    mark_posted_and_store(it, pr, urg)
-                    await asyncio.sleep(random.uniform(0.2, 0.9))
-            if posted > 0:
+            logging.info(f"Fetching {len(due)}/{len(scheduler)} due feeds...")
+            if not open_window:
+                logging.info("Outside hours_window — new items wait for the window")
+            # лента → отсев → обогащение → outbox идут внахлёст
+            tracer.begin(feeds=len(due))
+            # в пакетном режиме воркеров не меньше пачки, иначе она не наберётся
+            workers = max(PIPELINE_ENRICH_WORKERS, LLM_BATCH_SIZE) if llm_batcher is not None else PIPELINE_ENRICH_WORKERS
+            async with Pipeline(enrich, send, workers=workers, queue_size=max(workers, PIPELINE_QUEUE_SIZE)) as pipe:
+                await fetch_all(due, on_feed)
+                # остальное — лучшее по приоритету со всей пачки, а не кто раньше скачался
+                await take(rank_scored(candidates))
+            tracer.end(fetched=fetched, queued=queued, waiting=waiting, pipeline=pipe.stats())
+            logging.info(f"Fetched {fetched} items, queued {queued}"
+                         + (f", {waiting} stories wait for the next cycle" if waiting else "")
+                         + f"; pipeline: {pipe.stats()}")
+            logging.info(f"LLM cache: {llm_cache.stats()}; scheduler: {scheduler.stats()}; "
+                         f"dedup: {dedup.stats()}; stories: {stories.stats()}; policy: {policy.stats()}; "
+                         f"outbox: {outbox.stats()}"
+                         + (f"; llm batch: {llm_batcher.stats()}" if llm_batcher is not None else ""))
+            if queued and time.monotonic() - last_slowdown >= POLL_INTERVAL_SEC:
+                last_slowdown = time.monotonic()
                 await asyncio.sleep(SLOWDOWN_AFTER_BURST)
         except Exception as e:
             logging.exception(f"Loop error: {e}")
-        await asyncio.sleep(POLL_INTERVAL_SEC)
-
-def now_in_tz(tzname: str) -> datetime:
-    return datetime.now(ZoneInfo(tzname))
-
-def next_run_after(times_str: str, tzname: str) -> datetime:
-    tz = ZoneInfo(tzname)
-    now = datetime.now(tz)
-    times = []
-    for part in times_str.split(","):
-        part = part.strip()
-        if not re.match(r"^\d{2}:\d{2}$", part):
-            continue
-        hh, mm = map(int, part.split(":"))
-        candidate = now.replace(hour=hh, minute=mm, second=0, microsecond=0)
-        if candidate <= now:
-            candidate = candidate + timedelta(days=1)
-        times.append(candidate)
-    if not times:
-        return now + timedelta(hours=12)
-    return min(times)
-
-def build_digest_text(rows) -> str:
-    if not rows:
+        finally:
+            for url in due:
+                if url not in reported:
+                    scheduler.requeue(url)
+            if unsent:
+                # обогащение упало или цикл прервался — заявки не должны держать новости неделю
+                try:
+                    await leases.unclaim(list(unsent))
+                except Exception as e:
+                    logging.warning(f"Unclaim failed: {e!r}")
+            if profiler is not None:
+                profiler.stop()
+                path = profiler.dump(os.path.join(PROFILE_DIR, f"cycle-{int(time.time())}.folded"))
+                logging.info(f"Профиль цикла ({sum(profiler.samples.values())} семплов) — {path}; "
+                             f"flamegraph.pl {path} > cycle.svg или speedscope")
+
+def build_digest_text(entries: list[DigestEntry], hours: int) -> str:
+    if not entries:
         return "🗓 <b>Дайджест</b>\n• Новостей за период нет."
-    lines = []
-    title = f"🗓 <b>Итоги периода (последние {DIGEST_LOOKBACK_HOURS} ч)</b>"
-    lines.append(title)
-    for (ti, su, ln, pr, urg, ts) in rows:
-        emoji = "🚨" if urg else "•"
-        ti_c = clean_text(ti)
-        su_c = clean_text(su)
-        headline = ti_c if len(ti_c) <= 120 else ti_c[:117] + "…"
-        comment = su_c if len(su_c) <= 160 else su_c[:157] + "…"
-        lines.append(f"{emoji} <b>{translate_ru(headline) if detect_lang(headline)!='ru' else headline}</b>")
-        if comment:
-            lines.append(f"  — {translate_ru(comment) if detect_lang(comment)!='ru' else comment}")
-        if ln:
-            lines.append(f'  <a href="{ln}">Подробнее</a>')
+    lines = [f"🗓 <b>Итоги периода (последние {hours} ч)</b>"]
+    for e in entries:
+        lines.append(f"{'🚨' if e.urgent else '•'} <b>{e.headline}</b>")
+        if e.comment:
+            lines.append(f"  — {e.comment}")
+        if e.link:
+            lines.append(f'  <a href="{e.link}">Подробнее</a>')
     return "\n".join(lines)
 
 async def digest_loop(bot: Bot):
@@ -443,24 +794,49 @@ async def digest_loop(bot: Bot):
         return
     while True:
         try:
-            nxt = next_run_after(DIGEST_TIMES, DIGEST_TZ)
-            sleep_s = (nxt - now_in_tz(DIGEST_TZ)).total_seconds()
-            logging.info(f"Next digest at {nxt.isoformat()} ({DIGEST_TZ}) in {int(sleep_s)}s")
+            fire = digest.next_fire()
+            sleep_s = fire - time.time()
+            logging.info(f"Next digest at {datetime.fromtimestamp(fire, digest.tz).isoformat()} ({DIGEST_TZ}) "
+                         f"in {int(sleep_s)}s; board: {digest.stats()}")
             await asyncio.sleep(max(5, sleep_s))
-            rows = read_recent_items(DIGEST_LOOKBACK_HOURS, DIGEST_TOP_N)
-            text = build_digest_text(rows)
-            await safe_send_message(bot, CHANNEL_ID, text)
+            # всё уже собрано и переведено — только отсеять повторы истории и отрендерить
+            for hours, entries in digest.take(fire).items():
+                entries = stories.distinct(entries, text=lambda e: e.text, limit=DIGEST_TOP_N)
+                await outbox.enqueue(CHANNEL_IDS, build_digest_text(entries, hours), lane="digest")
             await asyncio.sleep(5)
         except Exception as e:
             logging.exception(f"Digest error: {e}")
             await asyncio.sleep(30)
 
+def slowest_feeds(n: int = 10) -> dict:
+    return dict(sorted(_feed_latency.items(), key=lambda kv: kv[1][0], reverse=True)[:n])
+
+metrics.sources.update(llm_cache=llm_cache.stats, dedup=dedup.stats, stories=stories.stats, policy=policy.stats,
+                       outbox=outbox.stats, digest=digest.stats, slowest_feeds=slowest_feeds,
+                       http=http.stats)
+profile_requested = PROFILE_CYCLE
+watchdog = LoopWatchdog()
+metrics.sources["loop"] = watchdog.stats
+if llm_batcher is not None:
+    metrics.sources["llm_batch"] = llm_batcher.stats
+if SHARDED:
+    metrics.sources.update(leases=leases.stats, leader=leader.stats)
+metrics.gauges.update(outbox_queued=lambda: outbox.stats()["queued"],
+                      llm_cache_hit_rate=lambda: llm_cache.stats()["hit_rate"],
+                      http_reuse_rate=lambda: http.stats()["reuse_rate"])
+
 async def start_health_server():
     async def handle_health(request):
         return web.Response(text="OK")
+    async def handle_metrics(request):
+        return web.Response(text=metrics.render(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+    async def handle_debug_stats(request):
+        return web.json_response(metrics.snapshot(), dumps=lambda o: json.dumps(o, ensure_ascii=False, default=str))
     app = web.Application()
     app.router.add_get("/", handle_health)
     app.router.add_get("/health", handle_health)
+    app.router.add_get("/metrics", handle_metrics)
+    app.router.add_get("/debug/stats", handle_debug_stats)
     runner = web.AppRunner(app)
     await runner.setup()
     site = web.TCPSite(runner, "0.0.0.0", PORT)
@@ -469,20 +845,59 @@ async def start_health_server():
 
 async def on_startup(bot: Bot):
     logging.info("🚀 Bot started successfully")
-    try:
-        await bot.send_message(CHANNEL_ID, "✅ Axed News v3.1: умная ссылка в заголовке + лаконичный пересказ — активированы.")
-    except Exception as e:
-        logging.exception(f"Не удалось отправить тест в канал: {e}")
+    for chat_id in CHANNEL_IDS:
+        try:
+            await bot.send_message(chat_id, "✅ Axed News v3.1: умная ссылка в заголовке + лаконичный пересказ — активированы.")
+        except Exception as e:
+            logging.exception(f"Не удалось отправить тест в канал {chat_id}: {e}")
+
+leader_tasks: list[asyncio.Task] = []
+
+async def on_leadership(bot: Bot, is_leader: bool):
+    """SHARD_COUNT > 1: отправку, дайджест, retention и команды бота ведёт только лидер."""
+    if is_leader:
+        await load_digest()   # доску собирал прошлый лидер — берём из items
+        outbox.start(bot, fence=leader.holds)
+        leader_tasks.extend(asyncio.create_task(c) for c in (
+            digest_loop(bot), retention_loop(),
+            dp.start_polling(bot, handle_signals=False, close_bot_session=False)))
+    else:
+        for t in leader_tasks:
+            t.cancel()
+        await asyncio.gather(*leader_tasks, return_exceptions=True)
+        leader_tasks.clear()
+        await outbox.stop()
 
 async def main():
-    db_init()
+    await db_init()
+    http.session()
     bot = Bot(BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-    await on_startup(bot)
+    asyncio.create_task(watchdog.run())
+    if SHARDED:
+        logging.info(f"Sharded mode: {WORKER_ID}, shard {SHARD_INDEX}/{SHARD_COUNT}")
+        leader.on_change = lambda is_leader: on_leadership(bot, is_leader)
+    else:
+        await on_startup(bot)
+        outbox.start(bot)
+        asyncio.create_task(digest_loop(bot))
+        asyncio.create_task(retention_loop())
     asyncio.create_task(worker_loop(bot))
-    asyncio.create_task(digest_loop(bot))
     if BIND_WEB:
         asyncio.create_task(start_health_server())
-    await dp.start_polling(bot)
+    try:
+        if SHARDED:
+            await leader.run()
+        else:
+            await dp.start_polling(bot)
+    finally:
+        if SHARDED:
+            await leader.resign()
+            await bot.session.close()
+        await outbox.stop()
+        await llm.close()
+        await http.close()
+        parse_pool.close()
+        await store.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,48 @@
+import re
+from typing import Iterable, Optional
+
+
+class KeywordMatcher:
+    """Скомпилированный один раз словарь ключевых слов; все хиты — за один вызов.
+
+    Без boundary — поиск подстрок (семантика `any(k in text for k in kws)`):
+    по замерам bench/bench_matcher.py проход по уникальным словам через
+    `str.__contains__` для словаря в десятки слов быстрее, чем альтернация в
+    `re`, поэтому regex здесь не строится.
+
+    С boundary (класс символов, которыми слово не должно быть окружено) —
+    один regex с lookahead на каждой позиции, длинные слова первыми, так что
+    перекрывающиеся вхождения тоже находятся.
+    """
+
+    def __init__(self, keywords: Iterable[str], boundary: Optional[str] = None):
+        self.keywords = tuple(dict.fromkeys(k for k in keywords if k))
+        self.boundary = boundary
+        self._order = {k: i for i, k in enumerate(self.keywords)}
+        self._re = None
+        if boundary and self.keywords:
+            alts = "|".join(re.escape(k) for k in sorted(self.keywords, key=len, reverse=True))
+            self._re = re.compile(rf"(?<!{boundary})(?=({alts})(?!{boundary}))")
+
+    def hits(self, text: str) -> frozenset:
+        if not text:
+            return frozenset()
+        if self._re is None:
+            return frozenset(k for k in self.keywords if k in text)
+        return frozenset(m.group(1) for m in self._re.finditer(text))
+
+    def first(self, text: str) -> Optional[re.Match]:
+        """Вхождение слова, стоящего раньше всех в исходном списке (а не в тексте).
+
+        Только для режима с boundary.
+        """
+        if not text or self._re is None:
+            return None
+        best, best_rank = None, len(self._order)
+        for m in self._re.finditer(text):
+            rank = self._order[m.group(1)]
+            if rank < best_rank:
+                best, best_rank = m, rank
+                if rank == 0:
+                    break
+        return best
@@ -0,0 +1,172 @@
+import time, bisect, threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+PREFIX = "axed_"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+WAIT_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 900, 3600)
+TRACE_KEEP = 20
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{str(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name, self.help, self.labelnames = PREFIX + name, help, labels
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, n: float = 1, **labels):
+        key = tuple(labels.get(k, "") for k in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + n
+
+    def render(self) -> list[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, v in sorted(self._values.items()):
+            out.append(f"{self.name}_total{_labels(self.labelnames, key)} {v:g}")
+        return out
+
+    def snapshot(self):
+        return {",".join(map(str, k)) or "_": v for k, v in sorted(self._values.items())}
+
+
+class Histogram:
+    """Кумулятивные корзины в формате Prometheus; observe() можно звать из любого потока."""
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name, self.help, self.labelnames = PREFIX + name, help, labels
+        self.buckets = tuple(sorted(buckets))
+        self._series: dict[tuple, list] = {}   # key -> [counts по корзинам + inf, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(k, "") for k in self.labelnames)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(key)
+            if s is None:
+                s = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            s[0][i] += 1
+            s[1] += value
+            s[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def render(self) -> list[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, n) in sorted(self._series.items()):
+            acc = 0
+            for le, c in zip(self.buckets, counts):
+                acc += c
+                lab = _labels(self.labelnames, key, 'le="%g"' % le)
+                out.append(f"{self.name}_bucket{lab} {acc}")
+            lab = _labels(self.labelnames, key, 'le="+Inf"')
+            out.append(f"{self.name}_bucket{lab} {n}")
+            lab = _labels(self.labelnames, key)
+            out.append(f"{self.name}_sum{lab} {total:.6f}")
+            out.append(f"{self.name}_count{lab} {n}")
+        return out
+
+    def snapshot(self):
+        return {",".join(map(str, k)) or "_": {"count": n, "sum": round(total, 4),
+                                               "avg": round(total / n, 4) if n else 0.0}
+                for k, (_, total, n) in sorted(self._series.items())}
+
+
+class Tracer:
+    """Тайминги стадий цикла: последние TRACE_KEEP циклов для /debug/stats.
+
+    Стадии конвейера идут внахлёст, поэтому по стадии копится суммарное занятое
+    время и число вызовов, а у цикла — ещё и полное время по часам.
+    """
+
+    def __init__(self, keep: int = TRACE_KEEP):
+        self.cycles: deque = deque(maxlen=keep)
+        self._cur: Optional[dict] = None
+
+    def begin(self, **info):
+        self._cur = {"started": time.time(), "wall_sec": None, "stages": {}, **info}
+        self.cycles.append(self._cur)
+
+    def end(self, **info):
+        if self._cur is not None:
+            self._cur["wall_sec"] = round(time.time() - self._cur["started"], 3)
+            self._cur.update(info)
+            STAGE_SECONDS.observe(self._cur["wall_sec"], stage="cycle")
+            self._cur = None
+
+    @contextmanager
+    def span(self, stage: str):
+        cur = self._cur
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            dt = time.perf_counter() - t0
+            STAGE_SECONDS.observe(dt, stage=stage)
+            if cur is not None:
+                st = cur["stages"].setdefault(stage, {"sec": 0.0, "calls": 0, "max_sec": 0.0})
+                st["sec"] = round(st["sec"] + dt, 4)
+                st["calls"] += 1
+                st["max_sec"] = round(max(st["max_sec"], dt), 4)
+
+
+FEED_FETCH_SECONDS = Histogram("feed_fetch_seconds", "Время скачивания одной ленты", ("outcome",))
+FEED_PARSE_SECONDS = Histogram("feed_parse_seconds", "Время разбора одной ленты", buckets=DB_BUCKETS + (2.5, 5))
+LLM_CALL_SECONDS = Histogram("llm_call_seconds", "Один HTTP-запрос к LLM", ("status",))
+LLM_CACHE_LOOKUPS = Counter("llm_cache_lookups", "Обращения к кэшу LLM", ("result",))
+SEND_SECONDS = Histogram("send_seconds", "Отправка одного сообщения в Telegram", ("result",))
+FLOOD_WAIT_SECONDS = Histogram("flood_wait_seconds", "RetryAfter от Telegram", buckets=WAIT_BUCKETS)
+DB_QUERY_SECONDS = Histogram("db_query_seconds", "Один вызов в потоке SQLite", ("op",), buckets=DB_BUCKETS)
+STAGE_SECONDS = Histogram("stage_seconds", "Стадии цикла", ("stage",))
+LOOP_LAG_SECONDS = Histogram("loop_lag_seconds", "Опоздание таймера event loop", buckets=LATENCY_BUCKETS[:-2])
+HTTP_CONNECTIONS = Counter("http_connections", "Соединения общего HTTP-пула: new, reused", ("result",))
+ITEMS = Counter("items", "Элементы по стадиям: fetched, deduped, filtered, story_dup, claimed_elsewhere, admitted, posted", ("stage",))
+
+METRICS = [FEED_FETCH_SECONDS, FEED_PARSE_SECONDS, LLM_CALL_SECONDS, LLM_CACHE_LOOKUPS, SEND_SECONDS,
+           FLOOD_WAIT_SECONDS, DB_QUERY_SECONDS, STAGE_SECONDS, LOOP_LAG_SECONDS, HTTP_CONNECTIONS, ITEMS]
+
+tracer = Tracer()
+# источники gauge-значений: name -> fn() -> число (очереди, размеры индексов и т.п.)
+gauges: dict[str, Callable[[], float]] = {}
+# stats() компонентов для /debug/stats: name -> fn() -> dict
+sources: dict[str, Callable[[], dict]] = {}
+
+
+def render() -> str:
+    lines = []
+    for m in METRICS:
+        lines.extend(m.render())
+    for name, fn in sorted(gauges.items()):
+        try:
+            value = float(fn())
+        except Exception:
+            continue
+        lines += [f"# TYPE {PREFIX}{name} gauge", f"{PREFIX}{name} {value:g}"]
+    return "\n".join(lines) + "\n"
+
+
+def snapshot() -> dict:
+    out = {}
+    for name, fn in sorted(sources.items()):
+        try:
+            out[name] = fn()
+        except Exception as e:
+            out[name] = {"error": repr(e)}
+    return {"components": out,
+            "metrics": {m.name: m.snapshot() for m in METRICS},
+            "cycles": list(tracer.cycles)}
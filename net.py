@@ -0,0 +1,93 @@
+import os, logging
+from typing import Optional
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from metrics import HTTP_CONNECTIONS
+
+HTTP_LIMIT = int(os.getenv("HTTP_LIMIT", "100"))                  # сокетов на всё приложение
+HTTP_LIMIT_PER_HOST = int(os.getenv("HTTP_LIMIT_PER_HOST", "8"))  # на один хост
+HTTP_DNS_TTL_SEC = int(os.getenv("HTTP_DNS_TTL_SEC", "300"))
+HTTP_KEEPALIVE_SEC = float(os.getenv("HTTP_KEEPALIVE_SEC", "60"))
+HTTP_TIMEOUT_SEC = float(os.getenv("HTTP_TIMEOUT_SEC", "30"))
+HTTP_CONNECT_TIMEOUT_SEC = float(os.getenv("HTTP_CONNECT_TIMEOUT_SEC", "10"))
+HTTP_USER_AGENT = os.getenv("HTTP_USER_AGENT", "AxedNewsBot/3.1")
+
+
+class HttpPool:
+    """Одна aiohttp-сессия на приложение: keep-alive, лимиты сокетов, кэш DNS.
+
+    Ленты и LLM ходят через session(), так что повторный опрос того же хоста
+    берёт уже открытое соединение вместо нового TCP+TLS и DNS. Сессия создаётся
+    при первом обращении (нужен запущенный loop) и живёт до close().
+    """
+
+    def __init__(self, limit: int = HTTP_LIMIT, limit_per_host: int = HTTP_LIMIT_PER_HOST,
+                 dns_ttl: int = HTTP_DNS_TTL_SEC, keepalive: float = HTTP_KEEPALIVE_SEC,
+                 timeout: float = HTTP_TIMEOUT_SEC, connect_timeout: float = HTTP_CONNECT_TIMEOUT_SEC):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_ttl = dns_ttl
+        self.keepalive = keepalive
+        self.timeout = aiohttp.ClientTimeout(total=timeout, sock_connect=connect_timeout)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.requests = 0
+        self.new_conns = 0
+        self.reused = 0
+        self.dns_hits = 0
+        self.dns_misses = 0
+        self.hosts: dict[str, int] = {}
+
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host,
+                                             ttl_dns_cache=self.dns_ttl, keepalive_timeout=self.keepalive,
+                                             enable_cleanup_closed=True)
+            trace = aiohttp.TraceConfig()
+            trace.on_request_start.append(self._on_request)
+            trace.on_connection_create_end.append(self._on_new_conn)
+            trace.on_connection_reuseconn.append(self._on_reuse)
+            trace.on_dns_cache_hit.append(self._on_dns_hit)
+            trace.on_dns_cache_miss.append(self._on_dns_miss)
+            # Accept-Encoding gzip/deflate aiohttp ставит сам и сам же распаковывает
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout,
+                                                  headers={"User-Agent": HTTP_USER_AGENT},
+                                                  trace_configs=[trace])
+            logging.info(f"HTTP pool: limit={self.limit}, per_host={self.limit_per_host}, dns_ttl={self.dns_ttl}s")
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _on_request(self, session, ctx, params):
+        self.requests += 1
+        host = urlsplit(str(params.url)).hostname or ""
+        self.hosts[host] = self.hosts.get(host, 0) + 1
+
+    async def _on_new_conn(self, session, ctx, params):
+        self.new_conns += 1
+        HTTP_CONNECTIONS.inc(result="new")
+
+    async def _on_reuse(self, session, ctx, params):
+        self.reused += 1
+        HTTP_CONNECTIONS.inc(result="reused")
+
+    async def _on_dns_hit(self, session, ctx, params):
+        self.dns_hits += 1
+
+    async def _on_dns_miss(self, session, ctx, params):
+        self.dns_misses += 1
+
+    def stats(self) -> dict:
+        conns = self.new_conns + self.reused
+        return {"requests": self.requests, "new_connections": self.new_conns, "reused": self.reused,
+                "reuse_rate": round(self.reused / conns, 3) if conns else 0.0,
+                "dns_hits": self.dns_hits, "dns_misses": self.dns_misses,
+                "limit": self.limit, "limit_per_host": self.limit_per_host,
+                "top_hosts": dict(sorted(self.hosts.items(), key=lambda kv: -kv[1])[:10])}
+
+
+http = HttpPool()
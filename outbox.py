@@ -0,0 +1,417 @@
+import os, json, time, heapq, random, sqlite3, asyncio, logging
+from typing import Awaitable, Callable, Iterable, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest
+
+from metrics import SEND_SECONDS, FLOOD_WAIT_SECONDS
+
+# Telegram: не больше ~20 сообщений в минуту в один канал/группу
+OUTBOX_RATE_PER_MIN = float(os.getenv("OUTBOX_RATE_PER_MIN", "20"))
+OUTBOX_BURST = float(os.getenv("OUTBOX_BURST", "3"))
+MIN_SECONDS_BETWEEN_POSTS = float(os.getenv("MIN_SECONDS_BETWEEN_POSTS", "1.8"))
+RETRY_AFTER_GRACE = int(os.getenv("RETRY_AFTER_GRACE", "2"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))   # ошибки отправки; flood-wait не считается
+OUTBOX_ERROR_RETRY_SEC = float(os.getenv("OUTBOX_ERROR_RETRY_SEC", "5"))   # БД недоступна — повтор сообщения через
+OUTBOX_KEEP_SENT_HOURS = float(os.getenv("OUTBOX_KEEP_SENT_HOURS", "48"))
+OUTBOX_SYNC_SEC = float(os.getenv("OUTBOX_SYNC_SEC", "2"))   # shared: как часто лидер забирает чужие сообщения
+# shared: строка в 'sending' дольше этого — её отправитель умер, возвращаем в очередь
+OUTBOX_SENDING_STALE_SEC = float(os.getenv("OUTBOX_SENDING_STALE_SEC", "120"))
+
+LANES = {"urgent": 0, "digest": 1, "regular": 2}
+
+
+class TokenBucket:
+    def __init__(self, rate_per_sec: float, burst: float, min_interval: float = 0.0):
+        self.rate = rate_per_sec
+        self.burst = max(1.0, burst)
+        self.min_interval = min_interval
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.last_take = 0.0
+
+    def wait_time(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        need = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(need, self.last_take + self.min_interval - now)
+
+    def take(self):
+        self.tokens -= 1
+        self.last_take = time.monotonic()
+
+
+class _Chat:
+    def __init__(self, chat_id: int):
+        self.chat_id = chat_id
+        self.bucket = TokenBucket(OUTBOX_RATE_PER_MIN / 60.0, OUTBOX_BURST, MIN_SECONDS_BETWEEN_POSTS)
+        self.heap: list[tuple[int, float, int]] = []   # (lane, not_before, id)
+        self.wake = asyncio.Event()
+        self.blocked_until = 0.0                        # flood-wait этого чата (time.time())
+        self.task: Optional[asyncio.Task] = None
+
+
+class Outbox:
+    """Персистентная очередь отправки в Telegram.
+
+    Сообщение сначала пишется в таблицу outbox и только потом отправляется, так
+    что рестарт посреди flood-wait ничего не теряет. У каждого чата свой token
+    bucket и свой отправитель: flood-wait одного канала не держит остальные.
+    Внутри чата — полосы urgent > digest > regular.
+    on_delivered(guid, meta) зовётся один раз на guid — при первой доставке,
+    on_failed(guid) — если guid окончательно не ушёл ни в один канал.
+
+    shared=True — в таблицу пишут несколько процессов (шарды), а отправляет
+    только тот, у кого вызван start(): он раз в OUTBOX_SYNC_SEC подбирает
+    новые строки. Остальные только пишут в таблицу и ничего не держат в памяти.
+    Перед отправкой строка переводится queued → sending одним UPDATE, так что
+    при смене лидера одну строку не отправят два процесса; fence() — ещё можно
+    ли отправлять (лиз лидера не истёк).
+    """
+
+    def __init__(self, store, on_delivered: Optional[Callable[[str, dict], Awaitable[None]]] = None,
+                 shared: bool = False, on_failed: Optional[Callable[[str], Awaitable[None]]] = None,
+                 owner: str = ""):
+        self.store = store
+        self.owner = owner
+        self.bot: Optional[Bot] = None
+        self.fence: Optional[Callable[[], bool]] = None
+        self.on_delivered = on_delivered
+        self.on_failed = on_failed
+        self.shared = shared
+        self._chats: dict[int, _Chat] = {}
+        self._pending_guids: dict[str, int] = {}
+        self._known: set[int] = set()   # id, уже лежащие в кучах
+        self._last_id = 0                # shared: до какого id таблица просмотрена
+        self._sync_task: Optional[asyncio.Task] = None
+        self._started = False
+        self.sent = 0
+        self.failed = 0
+        self.flood_waits = 0
+        self.flood_wait_sec = 0.0
+
+    async def init(self):
+        # строки, которые мы сами не дослали до рестарта, — снова в очередь
+        rows = await self.store.run(_init_and_load, self.owner if self.shared else None)
+        if self.shared:
+            return   # подберёт sync() того, кто станет отправителем
+        for msg_id, chat_id, lane, not_before, guid in rows:
+            self._push(chat_id, LANES.get(lane, 2), not_before or 0.0, msg_id, guid)
+        if rows:
+            logging.info(f"Outbox: {len(rows)} queued messages restored")
+
+    def start(self, bot: Bot, fence: Optional[Callable[[], bool]] = None):
+        self.bot = bot
+        self.fence = fence
+        self._started = True
+        for chat in self._chats.values():
+            self._ensure_worker(chat)
+        if self.shared and self._sync_task is None:
+            self._sync_task = asyncio.create_task(self._sync_loop())
+
+    async def stop(self):
+        self._started = False
+        tasks = [c.task for c in self._chats.values() if c.task]
+        if self._sync_task is not None:
+            tasks.append(self._sync_task)
+            self._sync_task = None
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for c in self._chats.values():
+            c.task = None
+
+    async def sync(self) -> int:
+        """Забрать в очередь строки, поставленные другими процессами."""
+        stale = await self.store.run(_recover, time.time() - OUTBOX_SENDING_STALE_SEC)
+        if stale:
+            logging.warning(f"Outbox: {len(stale)} messages stuck in 'sending' returned to the queue")
+        rows = await self.store.run(_load_since, self._last_id)
+        n = 0
+        for msg_id, chat_id, lane, not_before, guid in stale + rows:
+            self._last_id = max(self._last_id, msg_id)
+            if msg_id not in self._known:
+                self._push(chat_id, LANES.get(lane, 2), not_before or 0.0, msg_id, guid)
+                n += 1
+        return n
+
+    async def _sync_loop(self):
+        while True:
+            try:
+                n = await self.sync()
+                if n:
+                    logging.debug(f"Outbox: {n} messages picked up from other workers")
+            except Exception as e:
+                logging.warning(f"Outbox sync failed: {e}")
+            await asyncio.sleep(OUTBOX_SYNC_SEC)
+
+    def pending_guids(self) -> set[str]:
+        """guid, которые уже стоят в очереди — их не надо пускать в обработку повторно."""
+        return set(self._pending_guids)
+
+    async def enqueue(self, chat_ids: Iterable[int], text: str, lane: str = "regular",
+                      guid: Optional[str] = None, meta: Optional[dict] = None):
+        lane = lane if lane in LANES else "regular"
+        chat_ids = list(chat_ids)
+        ids = await self.store.run(_insert, chat_ids, lane, text, guid, json.dumps(meta or {}, ensure_ascii=False))
+        if self.shared and not self._started:
+            return
+        for chat_id, msg_id in zip(chat_ids, ids):
+            self._push(chat_id, LANES[lane], 0.0, msg_id, guid)
+
+    def _push(self, chat_id: int, lane: int, not_before: float, msg_id: int, guid: Optional[str]):
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _Chat(chat_id)
+        heapq.heappush(chat.heap, (lane, not_before, msg_id))
+        self._known.add(msg_id)
+        if guid:
+            self._pending_guids[guid] = self._pending_guids.get(guid, 0) + 1
+        chat.wake.set()
+        if self._started:
+            self._ensure_worker(chat)
+
+    def _ensure_worker(self, chat: _Chat):
+        if chat.task is None or chat.task.done():
+            chat.task = asyncio.create_task(self._worker(chat))
+
+    def _release_guid(self, guid: Optional[str]):
+        if guid and guid in self._pending_guids:
+            self._pending_guids[guid] -= 1
+            if self._pending_guids[guid] <= 0:
+                del self._pending_guids[guid]
+
+    def _may_send(self) -> bool:
+        return self.fence is None or self.fence()
+
+    async def _worker(self, chat: _Chat):
+        while True:
+            if not chat.heap:
+                chat.wake.clear()
+                await chat.wake.wait()
+                continue
+            if not self._may_send():
+                # лиз лидера мог истечь — ждём, пока роль продлят или нас остановят
+                await asyncio.sleep(0.5)
+                continue
+            now = time.time()
+            # первое по полосе сообщение, которому уже можно
+            ready = [e for e in chat.heap if e[1] <= now]
+            if not ready or chat.blocked_until > now:
+                soonest = min(e[1] for e in chat.heap)
+                delay = max(chat.blocked_until, soonest) - now
+                chat.wake.clear()
+                try:
+                    await asyncio.wait_for(chat.wake.wait(), timeout=max(0.05, delay))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            wait = chat.bucket.wait_time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            entry = min(ready)
+            chat.heap.remove(entry)
+            heapq.heapify(chat.heap)
+            try:
+                await self._deliver(chat, entry)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # например, database is locked: сообщение не теряем и отправителя чата не роняем
+                logging.warning(f"Outbox: message {entry[2]} to {chat.chat_id} failed, retry in {OUTBOX_ERROR_RETRY_SEC}s: {e!r}")
+                heapq.heappush(chat.heap, (entry[0], time.time() + OUTBOX_ERROR_RETRY_SEC, entry[2]))
+
+    async def _deliver(self, chat: _Chat, entry: tuple[int, float, int]):
+        lane, _, msg_id = entry
+        row = await self.store.run(_take, msg_id, self.owner)
+        if row is None:
+            # уже отправлена или её забрал другой процесс
+            self._known.discard(msg_id)
+            return
+        text, guid, meta, attempts = row
+        if not self._may_send():
+            await self.store.run(_untake, msg_id, self.owner)
+            heapq.heappush(chat.heap, entry)
+            return
+        chat.bucket.take()
+        t0 = time.monotonic()
+        try:
+            await self.bot.send_message(chat_id=chat.chat_id, text=text, disable_web_page_preview=False)
+        except TelegramRetryAfter as e:
+            SEND_SECONDS.observe(time.monotonic() - t0, result="flood_wait")
+            wait_s = int(getattr(e, "retry_after", 5)) + RETRY_AFTER_GRACE
+            FLOOD_WAIT_SECONDS.observe(wait_s)
+            self.flood_waits += 1
+            self.flood_wait_sec += wait_s
+            chat.blocked_until = time.time() + wait_s
+            logging.warning(f"Flood limit in {chat.chat_id}: retry after {wait_s}s")
+            # flood-wait — не ошибка поста: в OUTBOX_MAX_ATTEMPTS не считаем
+            await self._retry(chat, lane, msg_id, guid, attempts, chat.blocked_until, count=False)
+            return
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            SEND_SECONDS.observe(time.monotonic() - t0, result="rejected")
+            logging.exception(f"Send failed (forbidden/bad request): {e}")
+            await self._fail(msg_id, guid)
+            return
+        except Exception as e:
+            SEND_SECONDS.observe(time.monotonic() - t0, result="error")
+            logging.exception(f"Send failed (generic): {e}")
+            backoff = min(300, 5 * 2 ** attempts) * random.uniform(0.5, 1.0)
+            await self._retry(chat, lane, msg_id, guid, attempts, time.time() + backoff)
+            return
+        SEND_SECONDS.observe(time.monotonic() - t0, result="ok")
+        self.sent += 1
+        first = await self._run_retrying(_mark_sent, msg_id, guid)   # уже ушло — повторная отправка хуже
+        self._known.discard(msg_id)
+        logging.debug(f"Sent {msg_id} to {chat.chat_id} in {time.monotonic() - t0:.2f}s")
+        try:
+            if first and guid and self.on_delivered is not None:
+                try:
+                    await self.on_delivered(guid, json.loads(meta or "{}"))
+                except Exception as e:
+                    logging.exception(f"on_delivered failed: {e}")
+        finally:
+            # из pending_guids — только когда on_delivered уже отметил guid опубликованным,
+            # иначе параллельный цикл успеет взять его снова
+            self._release_guid(guid)
+
+    async def _run_retrying(self, fn, *args, tries: int = 5):
+        for i in range(tries):
+            try:
+                return await self.store.run(fn, *args)
+            except sqlite3.OperationalError:
+                if i == tries - 1:
+                    raise
+                await asyncio.sleep(0.5 * 2 ** i)
+
+    async def _retry(self, chat: _Chat, lane: int, msg_id: int, guid: Optional[str], attempts: int,
+                     not_before: float, count: bool = True):
+        if count and attempts + 1 >= OUTBOX_MAX_ATTEMPTS:
+            await self._fail(msg_id, guid)
+            return
+        await self.store.run(_reschedule, msg_id, not_before, count)
+        heapq.heappush(chat.heap, (lane, not_before, msg_id))
+
+    async def _fail(self, msg_id: int, guid: Optional[str]):
+        self.failed += 1
+        last = await self.store.run(_mark_failed, msg_id, guid)
+        self._known.discard(msg_id)
+        self._release_guid(guid)
+        if last and guid and self.on_failed is not None:
+            try:
+                await self.on_failed(guid)
+            except Exception as e:
+                logging.exception(f"on_failed failed: {e}")
+
+    async def purge(self) -> int:
+        return await self.store.run(_purge, time.time() - OUTBOX_KEEP_SENT_HOURS * 3600)
+
+    def stats(self) -> dict:
+        return {
+            "queued": sum(len(c.heap) for c in self._chats.values()),
+            "sent": self.sent,
+            "failed": self.failed,
+            "flood_waits": self.flood_waits,
+            "flood_wait_sec": self.flood_wait_sec,
+            "chats": len(self._chats),
+        }
+
+
+def _init_and_load(con: sqlite3.Connection, owner: Optional[str]):
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS outbox (
+        id         INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id    INTEGER,
+        lane       TEXT,
+        text       TEXT,
+        guid       TEXT,
+        meta       TEXT,
+        created    REAL,
+        not_before REAL DEFAULT 0,
+        attempts   INTEGER DEFAULT 0,
+        status     TEXT DEFAULT 'queued'
+    )
+    """)
+    cols = {r[1] for r in con.execute("PRAGMA table_info(outbox)")}
+    for col, typ in (("owner", "TEXT"), ("claimed", "REAL")):
+        if col not in cols:
+            con.execute(f"ALTER TABLE outbox ADD COLUMN {col} {typ}")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_outbox_status ON outbox(status, created)")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_outbox_guid ON outbox(guid)")
+    # owner=None — отправитель один, всё 'sending' осталось от нашего прошлого запуска
+    if owner is None:
+        con.execute("UPDATE outbox SET status='queued', owner=NULL WHERE status='sending'")
+    else:
+        con.execute("UPDATE outbox SET status='queued', owner=NULL WHERE status='sending' AND owner=?", (owner,))
+    con.commit()
+    return con.execute("SELECT id, chat_id, lane, not_before, guid FROM outbox WHERE status='queued' ORDER BY id").fetchall()
+
+def _load_since(con: sqlite3.Connection, last_id: int):
+    return con.execute("SELECT id, chat_id, lane, not_before, guid FROM outbox WHERE status='queued' AND id > ? ORDER BY id",
+                       (last_id,)).fetchall()
+
+def _insert(con: sqlite3.Connection, chat_ids, lane, text, guid, meta) -> list[int]:
+    ids = []
+    now = time.time()
+    with con:
+        for chat_id in chat_ids:
+            cur = con.execute("INSERT INTO outbox (chat_id, lane, text, guid, meta, created) VALUES (?, ?, ?, ?, ?, ?)",
+                              (chat_id, lane, text, guid, meta, now))
+            ids.append(cur.lastrowid)
+    return ids
+
+def _take(con: sqlite3.Connection, msg_id: int, owner: str):
+    """queued → sending за нами; None, если строку уже отправили или забрал другой процесс.
+
+    Свою 'sending' забираем снова: это повтор после ошибки БД посреди _deliver.
+    """
+    with con:
+        cur = con.execute("""UPDATE outbox SET status='sending', owner=?, claimed=?
+                             WHERE id=? AND (status='queued' OR (status='sending' AND owner=?))""",
+                          (owner, time.time(), msg_id, owner))
+        if cur.rowcount != 1:
+            return None
+        return con.execute("SELECT text, guid, meta, attempts FROM outbox WHERE id=?", (msg_id,)).fetchone()
+
+def _untake(con: sqlite3.Connection, msg_id: int, owner: str):
+    with con:
+        con.execute("UPDATE outbox SET status='queued', owner=NULL WHERE id=? AND status='sending' AND owner=?",
+                    (msg_id, owner))
+
+def _recover(con: sqlite3.Connection, before: float):
+    with con:
+        rows = con.execute("SELECT id, chat_id, lane, not_before, guid FROM outbox WHERE status='sending' AND claimed < ?",
+                           (before,)).fetchall()
+        con.executemany("UPDATE outbox SET status='queued', owner=NULL WHERE id=? AND status='sending'",
+                        [(r[0],) for r in rows])
+    return rows
+
+def _mark_sent(con: sqlite3.Connection, msg_id: int, guid: Optional[str]) -> bool:
+    """True, если это первая доставка этого guid (в любой из каналов)."""
+    with con:
+        first = True
+        if guid:
+            first = con.execute("SELECT 1 FROM outbox WHERE guid=? AND status='sent' LIMIT 1",
+                                (guid,)).fetchone() is None
+        con.execute("UPDATE outbox SET status='sent', attempts=attempts+1 WHERE id=?", (msg_id,))
+    return first
+
+def _reschedule(con: sqlite3.Connection, msg_id: int, not_before: float, count: bool = True):
+    with con:
+        con.execute("UPDATE outbox SET status='queued', owner=NULL, attempts=attempts+?, not_before=? WHERE id=?",
+                    (int(count), not_before, msg_id))
+
+def _mark_failed(con: sqlite3.Connection, msg_id: int, guid: Optional[str]) -> bool:
+    """True, если guid больше нигде не ждёт отправки и никуда не доставлен."""
+    with con:
+        con.execute("UPDATE outbox SET status='failed', attempts=attempts+1 WHERE id=?", (msg_id,))
+        if not guid:
+            return False
+        return con.execute("SELECT 1 FROM outbox WHERE guid=? AND status!='failed' LIMIT 1",
+                           (guid,)).fetchone() is None
+
+def _purge(con: sqlite3.Connection, before: float) -> int:
+    with con:
+        return con.execute("DELETE FROM outbox WHERE status IN ('sent', 'failed') AND created < ?", (before,)).rowcount
@@ -1,32 +1,235 @@
+import os
+import time
+import zlib
 import asyncio
 import logging
 import aiohttp
 import feedparser
-from typing import List, Dict, Any
-
-async def fetch_feed(session: aiohttp.ClientSession, url: str) -> List[Dict[str, Any]]:
-    try:
-        async with session.get(url, timeout=aiohttp.ClientTimeout(total=20)) as resp:
-            content = await resp.read()
-            feed = feedparser.parse(content)
-            items = []
-            for e in feed.entries[:15]:
-                guid = e.get("id") or e.get("guid") or e.get("link")
-                title = e.get("title", "").strip()
-                link = e.get("link", "").strip()
-                summary = (e.get("summary") or e.get("description") or "").strip()
-                items.append({"guid": guid, "title": title, "link": link, "summary": summary})
-            return items
-    except Exception as e:
-        logging.exception(f"Failed to fetch {url}: {e}")
-        return []
-
-async def fetch_all(feeds: List[str]) -> List[Dict[str, Any]]:
-    async with aiohttp.ClientSession() as session:
-        tasks = [fetch_feed(session, u) for u in feeds]
-        batches = await asyncio.gather(*tasks, return_exceptions=True)
-        results = []
-        for b in batches:
-            if isinstance(b, list):
-                results.extend(b)
-        return results
+from xml.etree.ElementTree import XMLPullParser, ParseError
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
+
+PARSE_BACKEND = os.getenv("PARSE_BACKEND", "thread")        # inline | thread | process
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", "2"))
+PARSE_MAX_ENTRIES = int(os.getenv("PARSE_MAX_ENTRIES", "50"))  # жёсткий потолок, если прошлый guid не нашёлся
+FEED_MAX_BYTES = int(os.getenv("FEED_MAX_BYTES", str(2 * 1024 * 1024)))   # после распаковки
+FEED_CHUNK_BYTES = 64 * 1024
+ENTRY_TAGS = ("item", "entry")
+
+
+def entry_guid(e) -> Optional[str]:
+    return e.get("id") or e.get("guid") or e.get("link")
+
+
+def parse_entries(content: bytes, last_guid: Optional[str] = None,
+                  max_entries: int = PARSE_MAX_ENTRIES) -> Tuple[List[Dict[str, Any]], float]:
+    """Распарсить тело ленты и вернуть компактные элементы, новее last_guid.
+
+    Ленты отдают записи от новых к старым, поэтому идём сверху и останавливаемся
+    на первом уже виденном guid. Функция верхнего уровня — её можно отдать в
+    ProcessPoolExecutor, наружу уходят только простые dict'ы.
+    """
+    t0 = time.perf_counter()
+    feed = feedparser.parse(content)
+    items = []
+    for e in feed.entries:
+        guid = entry_guid(e)
+        if last_guid and guid == last_guid:
+            break
+        if len(items) >= max_entries:
+            break
+        items.append({
+            "guid": guid,
+            "title": (e.get("title") or "").strip(),
+            "link": (e.get("link") or "").strip(),
+            "summary": (e.get("summary") or e.get("description") or "").strip(),
+        })
+    return items, time.perf_counter() - t0
+
+
+def _local(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1] if "}" in tag else tag
+
+
+def _text(el) -> str:
+    return "".join(el.itertext()).strip()
+
+
+def _entry_from_element(el) -> Dict[str, Any]:
+    """RSS <item> / Atom <entry> → тот же dict, что делает parse_entries из feedparser."""
+    fields: Dict[str, str] = {}
+    link = ""
+    for child in el:
+        name = _local(child.tag)
+        if name == "link":
+            href = child.get("href")
+            if href is None:
+                link = link or _text(child)
+            elif child.get("rel", "alternate") == "alternate" and not link:
+                link = href
+        elif name in ("encoded", "content"):
+            fields.setdefault("content", _text(child))
+        elif name not in fields:
+            fields[name] = _text(child)
+    guid = fields.get("id") or fields.get("guid") or link or None
+    return {
+        "guid": guid,
+        "title": fields.get("title", ""),
+        "link": link.strip(),
+        "summary": fields.get("description") or fields.get("summary") or fields.get("content", ""),
+    }
+
+
+class EntryStream:
+    """Потоковый разбор ленты: куски тела → готовые элементы, пока не встретим last_guid.
+
+    Распаковка gzip/deflate своя (запрос идёт с auto_decompress=False), размер
+    после распаковки ограничен max_bytes. Разбор — XMLPullParser (expat): каждый
+    <item>/<entry> обрабатывается, как только закрылся, и сразу выбрасывается.
+    Если XML оказался невалидным (HTML-сущности и т.п.), done=False и fallback=True —
+    тогда вызывающий отдаёт накопленное тело feedparser'у, как раньше.
+    """
+
+    def __init__(self, last_guid: Optional[str] = None, max_entries: int = PARSE_MAX_ENTRIES,
+                 max_bytes: int = FEED_MAX_BYTES, encoding: str = ""):
+        self.last_guid = last_guid
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.items: List[Dict[str, Any]] = []
+        self.body = bytearray()         # распакованное тело — только для запасного пути feedparser
+        self.done = False               # дальше читать не нужно
+        self.fallback = False
+        self.truncated = False
+        self.parse_sec = 0.0
+        self._parser = XMLPullParser(events=("end",))
+        encoding = (encoding or "").lower()
+        if encoding == "gzip":
+            self._zlib = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == "deflate":
+            self._zlib = zlib.decompressobj()
+        elif encoding in ("", "identity"):
+            self._zlib = None
+        else:
+            raise ValueError(f"unsupported Content-Encoding: {encoding}")
+        self._deflate_raw_tried = encoding != "deflate"
+
+    def feed(self, chunk: bytes):
+        if self._zlib is not None:
+            try:
+                chunk = self._zlib.decompress(chunk, max(1, self.max_bytes - len(self.body) + 1))
+            except zlib.error:
+                # часть серверов шлёт «deflate» без zlib-заголовка
+                if self._deflate_raw_tried or self.body:
+                    raise
+                self._deflate_raw_tried = True
+                self._zlib = zlib.decompressobj(-zlib.MAX_WBITS)
+                chunk = self._zlib.decompress(chunk, max(1, self.max_bytes + 1))
+        if len(self.body) + len(chunk) > self.max_bytes:
+            chunk = chunk[:self.max_bytes - len(self.body)]
+            self.truncated = self.done = True
+        self.body += chunk
+        if not self.fallback:
+            self._parse(chunk)
+
+    def _parse(self, chunk: bytes):
+        t0 = time.perf_counter()
+        try:
+            self._parser.feed(chunk)
+            for _, el in self._parser.read_events():
+                if _local(el.tag) not in ENTRY_TAGS:
+                    continue
+                item = _entry_from_element(el)
+                el.clear()
+                if (self.last_guid and item["guid"] == self.last_guid) or len(self.items) >= self.max_entries:
+                    self.done = True
+                    break
+                self.items.append(item)
+        except ParseError:
+            self.fallback = True
+            self.items = []
+        finally:
+            self.parse_sec += time.perf_counter() - t0
+
+    def finish(self):
+        if not self.done and not self.fallback:
+            try:
+                self._parser.close()
+            except ParseError:
+                self.fallback = True
+                self.items = []
+        # ничего не разобрали, хотя тело есть (не RSS/Atom по схеме, обрезано) — пусть решает feedparser
+        if not self.items and self.body and not (self.done and not self.truncated):
+            self.fallback = True
+
+
+async def stream_entries(resp: aiohttp.ClientResponse, last_guid: Optional[str] = None,
+                         max_entries: int = PARSE_MAX_ENTRIES, max_bytes: int = FEED_MAX_BYTES,
+                         pool: Optional["ParsePool"] = None) -> EntryStream:
+    """Читать тело кусками, пока EntryStream не скажет «хватит»; остаток не качаем.
+
+    Распаковка и разбор кусков идут через pool (по умолчанию parse_pool), а не в event loop.
+    """
+    pool = pool or parse_pool
+    stream = EntryStream(last_guid, max_entries, max_bytes, resp.headers.get("Content-Encoding", ""))
+    async for chunk in resp.content.iter_chunked(FEED_CHUNK_BYTES):
+        await pool.run_stream(stream.feed, chunk)
+        if stream.done:
+            break
+    await pool.run_stream(stream.finish)
+    return stream
+
+
+class ParsePool:
+    """Где гонять разбор лент: прямо в event loop, в потоках или в процессах.
+
+    Потоковый разбор (EntryStream) держит состояние expat между кусками, в другой
+    процесс его не передать — при backend=process он идёт в потоках, а процессы
+    достаются запасному пути feedparser.
+    """
+
+    def __init__(self, backend: str = PARSE_BACKEND, workers: int = PARSE_WORKERS):
+        if backend not in ("inline", "thread", "process"):
+            logging.warning(f"Unknown PARSE_BACKEND={backend!r}, falling back to thread")
+            backend = "thread"
+        self.backend = backend
+        self.workers = max(1, workers)
+        self._executor: Optional[Executor] = None
+        self._stream_executor: Optional[Executor] = None
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.backend == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="feedparse")
+        return self._executor
+
+    def _get_stream_executor(self) -> Executor:
+        if self.backend == "thread":
+            return self._get_executor()
+        if self._stream_executor is None:
+            self._stream_executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="feedstream")
+        return self._stream_executor
+
+    async def run_stream(self, fn, *args):
+        """Шаг потокового разбора (кусок тела → элементы); куски одной ленты идут по очереди."""
+        if self.backend == "inline":
+            return fn(*args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_stream_executor(), fn, *args)
+
+    async def parse(self, content: bytes, last_guid: Optional[str] = None,
+                    max_entries: int = PARSE_MAX_ENTRIES) -> Tuple[List[Dict[str, Any]], float]:
+        if self.backend == "inline":
+            return parse_entries(content, last_guid, max_entries)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), parse_entries, content, last_guid, max_entries)
+
+    def close(self):
+        for ex in (self._executor, self._stream_executor):
+            if ex is not None:
+                ex.shutdown(wait=False, cancel_futures=True)
+        self._executor = self._stream_executor = None
+
+
+parse_pool = ParsePool()
@@ -0,0 +1,91 @@
+import os, asyncio, itertools, logging, time
+from typing import Any, Awaitable, Callable, Optional
+
+PIPELINE_ENRICH_WORKERS = int(os.getenv("PIPELINE_ENRICH_WORKERS", "3"))
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "8"))
+
+
+class Pipeline:
+    """Обогащение и отправка одного цикла как конвейер с ограниченными очередями.
+
+    submit() → [enrich_q] → enrich-воркеры → [send_q] → один отправитель.
+    Обе очереди приоритетные: срочное уходит вперёд всего, что ещё ждёт.
+    Очереди ограничены, поэтому submit() ждёт, если обогащение не успевает,
+    а воркеры ждут, пока отправитель выбирает лимит Telegram, — память не растёт.
+    """
+
+    def __init__(self, enrich: Callable[[Any], Awaitable[Any]], send: Callable[[Any, Any], Awaitable[None]],
+                 workers: int = PIPELINE_ENRICH_WORKERS, queue_size: int = PIPELINE_QUEUE_SIZE):
+        self._enrich = enrich
+        self._send = send
+        self._workers = max(1, workers)
+        self._enrich_q: asyncio.PriorityQueue = asyncio.PriorityQueue(maxsize=queue_size)
+        self._send_q: asyncio.PriorityQueue = asyncio.PriorityQueue(maxsize=queue_size)
+        self._seq = itertools.count()
+        self._tasks: list[asyncio.Task] = []
+        self.submitted = 0
+        self.enriched = 0
+        self.sent = 0
+        self.errors = 0
+        self.first_send_at: Optional[float] = None
+        self._t0 = time.monotonic()
+
+    async def __aenter__(self):
+        self._tasks = [asyncio.create_task(self._enrich_worker()) for _ in range(self._workers)]
+        self._tasks.append(asyncio.create_task(self._sender()))
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                await self._enrich_q.join()
+                await self._send_q.join()
+        finally:
+            for t in self._tasks:
+                t.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def submit(self, rank: tuple, payload: Any):
+        """rank — ключ сортировки, меньше = раньше (например, (не срочно, -приоритет))."""
+        self.submitted += 1
+        await self._enrich_q.put((rank, next(self._seq), payload))
+
+    async def _enrich_worker(self):
+        while True:
+            rank, seq, payload = await self._enrich_q.get()
+            try:
+                result = await self._enrich(payload)
+                self.enriched += 1
+                await self._send_q.put((rank, seq, (payload, result)))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                logging.exception(f"Enrich failed: {e}")
+            finally:
+                self._enrich_q.task_done()
+
+    async def _sender(self):
+        while True:
+            rank, seq, (payload, result) = await self._send_q.get()
+            try:
+                if self.first_send_at is None:
+                    self.first_send_at = time.monotonic() - self._t0
+                await self._send(payload, result)
+                self.sent += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                logging.exception(f"Send stage failed: {e}")
+            finally:
+                self._send_q.task_done()
+
+    def stats(self) -> dict:
+        return {
+            "submitted": self.submitted,
+            "enriched": self.enriched,
+            "sent": self.sent,
+            "errors": self.errors,
+            "first_send_sec": round(self.first_send_at, 1) if self.first_send_at is not None else None,
+        }
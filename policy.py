@@ -0,0 +1,146 @@
+import os, json, logging
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+from matcher import KeywordMatcher
+
+CONFIG_FILE = os.getenv("CONFIG_FILE", "config.json")
+POLICY_TZ = os.getenv("POLICY_TZ", os.getenv("DIGEST_TZ", "Europe/Moscow"))
+SHORT_KEYWORD_LEN = 3          # «AI», «ЦБ», «IPO» ищем целым словом, иначе «ai» найдётся в «said»
+DROP_MEMORY = 20000            # сколько отброшенных guid помнить, чтобы не считать их повторно
+WORD_BOUNDARY = r"[\w]"
+
+
+def _compile_keywords(words) -> tuple[KeywordMatcher, KeywordMatcher]:
+    words = [w.strip().lower() for w in words or [] if w and w.strip()]
+    short = [w for w in words if len(w) <= SHORT_KEYWORD_LEN]
+    long_ = [w for w in words if len(w) > SHORT_KEYWORD_LEN]
+    return KeywordMatcher(long_), KeywordMatcher(short, boundary=WORD_BOUNDARY)
+
+
+class Policy:
+    """Фильтр и скоринг из config.json: дешёвая отсечка до любых LLM-вызовов.
+
+    Файл перечитывается при смене mtime; если новая версия битая, продолжаем
+    работать со старой.
+    """
+
+    def __init__(self, path: str = CONFIG_FILE, tz: str = POLICY_TZ):
+        self.path = path
+        self.tz = ZoneInfo(tz)
+        self._mtime: Optional[float] = None
+        self.loaded = False
+        self.include = self.exclude = None
+        self.languages: Optional[frozenset] = None
+        self.hours: Optional[tuple[int, int]] = None
+        self.max_posts_per_day: Optional[int] = None
+        self.keyword_hit = 0.0
+        self.priority_weight = 1.0
+        self.min_score = None
+        self.drops: dict[str, int] = {}
+        self._dropped: OrderedDict[str, None] = OrderedDict()
+        self._day = None
+        self._posted_today = 0
+        self.maybe_reload()
+
+    def maybe_reload(self) -> bool:
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            if self.loaded:
+                logging.warning(f"{self.path} пропал — оставляю последнюю загруженную политику")
+            return False
+        if mtime == self._mtime:
+            return False
+        self._mtime = mtime
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                self._compile(json.load(f))
+        except Exception as e:
+            logging.warning(f"Не удалось загрузить {self.path}: {e} — оставляю прежнюю политику")
+            return False
+        self.loaded = True
+        logging.info(f"Policy loaded from {self.path}")
+        return True
+
+    def _compile(self, cfg: dict):
+        include = _compile_keywords(cfg.get("include_keywords"))
+        exclude = _compile_keywords(cfg.get("exclude_keywords"))
+        langs = cfg.get("language_allowlist")
+        hours = cfg.get("hours_window")
+        score = cfg.get("score") or {}
+        # присваиваем только после того, как всё разобралось
+        self.include, self.exclude = include, exclude
+        self.languages = frozenset(langs) if langs else None
+        self.hours = (int(hours["start"]), int(hours["end"])) if hours else None
+        self.max_posts_per_day = int(cfg["max_posts_per_day"]) if cfg.get("max_posts_per_day") else None
+        self.keyword_hit = float(score.get("keyword_hit", 0.0))
+        self.priority_weight = float(score.get("priority_weight", 1.0))
+        self.min_score = float(score["min_score_to_post"]) if "min_score_to_post" in score else None
+
+    @staticmethod
+    def _hits(matchers, text: str) -> int:
+        long_, short = matchers
+        return len(long_.hits(text)) + len(short.hits(text))
+
+    def check(self, title: str, summary: str, lang: str, priority: float) -> Optional[str]:
+        """Причина отсева или None, если элемент проходит."""
+        if not self.loaded:
+            return None
+        text = f"{title} {summary}".lower()
+        if self.exclude and self._hits(self.exclude, text):
+            return "exclude_keywords"
+        if self.languages is not None and lang not in self.languages:
+            return "language_allowlist"
+        if self.min_score is not None:
+            score = self._hits(self.include, text) * self.keyword_hit + priority * self.priority_weight
+            if score < self.min_score:
+                return "min_score_to_post"
+        return None
+
+    def drop(self, reason: str, guid: Optional[str]):
+        # одна и та же новость висит в ленте много циклов — считаем её один раз
+        if guid:
+            if guid in self._dropped:
+                return
+            self._dropped[guid] = None
+            if len(self._dropped) > DROP_MEMORY:
+                self._dropped.popitem(last=False)
+        self.drops[reason] = self.drops.get(reason, 0) + 1
+
+    def in_hours(self, now: Optional[datetime] = None) -> bool:
+        if not self.loaded or self.hours is None:
+            return True
+        now = now or datetime.now(self.tz)
+        start, end = self.hours
+        if start <= end:
+            return start <= now.hour < end
+        return now.hour >= start or now.hour < end   # окно через полночь
+
+    def day_start_utc(self) -> str:
+        """Начало текущих суток в POLICY_TZ — в формате CURRENT_TIMESTAMP SQLite."""
+        local = datetime.now(self.tz).replace(hour=0, minute=0, second=0, microsecond=0)
+        return local.astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+    def set_posted_today(self, n: int):
+        self._day = datetime.now(self.tz).date()
+        self._posted_today = n
+
+    def note_posted(self, n: int = 1):
+        today = datetime.now(self.tz).date()
+        if today != self._day:
+            self._day, self._posted_today = today, 0
+        self._posted_today += n
+
+    def posts_left_today(self) -> Optional[int]:
+        if not self.loaded or self.max_posts_per_day is None:
+            return None
+        if datetime.now(self.tz).date() != self._day:
+            self._day, self._posted_today = datetime.now(self.tz).date(), 0
+        return max(0, self.max_posts_per_day - self._posted_today)
+
+    def stats(self) -> dict:
+        return {"drops": dict(self.drops), "dropped_total": sum(self.drops.values()),
+                "posted_today": self._posted_today}
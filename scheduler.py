@@ -0,0 +1,123 @@
+import os, heapq, random, time, logging
+from typing import Iterable, Optional
+
+SCHED_DEFAULT_INTERVAL_SEC = float(os.getenv("POLL_INTERVAL_SEC", "600"))
+SCHED_MIN_INTERVAL_SEC = float(os.getenv("SCHED_MIN_INTERVAL_SEC", "120"))
+SCHED_MAX_INTERVAL_SEC = float(os.getenv("SCHED_MAX_INTERVAL_SEC", "3600"))
+SCHED_MAX_BACKOFF_SEC = float(os.getenv("SCHED_MAX_BACKOFF_SEC", "21600"))          # 6 часов
+SCHED_COALESCE_SEC = float(os.getenv("SCHED_COALESCE_SEC", "15"))     # кто должен опроситься в ближайшие N сек — берём в текущую пачку
+SCHED_STARTUP_SPREAD_SEC = float(os.getenv("SCHED_STARTUP_SPREAD_SEC", "30"))
+SCHED_TARGET_NEW_PER_POLL = float(os.getenv("SCHED_TARGET_NEW_PER_POLL", "2"))
+RATE_EWMA_ALPHA = 0.3
+JITTER = 0.1
+
+
+class FeedState:
+    __slots__ = ("url", "min_interval", "max_interval", "interval", "next_due",
+                 "failures", "rate", "last_fetch", "seen")
+
+    def __init__(self, url: str, min_interval: float, max_interval: float, interval: float):
+        self.url = url
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.interval = min(max(interval, self.min_interval), self.max_interval)
+        self.next_due = 0.0
+        self.failures = 0
+        self.rate: Optional[float] = None          # новых элементов в секунду, EWMA
+        self.last_fetch: Optional[float] = None
+        self.seen: Optional[set] = None            # guid'ы из прошлого успешного опроса
+
+
+class FeedScheduler:
+    """Очередь лент по времени следующего опроса.
+
+    Интервал каждой ленты подстраивается под наблюдаемую частоту публикаций
+    (цель — около SCHED_TARGET_NEW_PER_POLL новых элементов за опрос), а на
+    ошибках растёт экспоненциально с джиттером.
+    """
+
+    def __init__(self, specs: Iterable[dict], now: Optional[float] = None):
+        now = time.monotonic() if now is None else now
+        self.feeds: dict[str, FeedState] = {}
+        self._heap: list[tuple[float, str]] = []
+        for spec in specs:
+            st = FeedState(
+                spec["url"],
+                spec.get("min_interval") or SCHED_MIN_INTERVAL_SEC,
+                spec.get("max_interval") or SCHED_MAX_INTERVAL_SEC,
+                SCHED_DEFAULT_INTERVAL_SEC,
+            )
+            st.next_due = now + random.uniform(0, SCHED_STARTUP_SPREAD_SEC)
+            self.feeds[st.url] = st
+            heapq.heappush(self._heap, (st.next_due, st.url))
+
+    def __len__(self):
+        return len(self.feeds)
+
+    def seconds_until_next(self, now: Optional[float] = None) -> float:
+        if not self._heap:
+            return SCHED_DEFAULT_INTERVAL_SEC
+        now = time.monotonic() if now is None else now
+        return max(0.0, self._heap[0][0] - now)
+
+    def pop_due(self, now: Optional[float] = None) -> list[str]:
+        now = time.monotonic() if now is None else now
+        due = []
+        while self._heap and self._heap[0][0] <= now + SCHED_COALESCE_SEC:
+            _, url = heapq.heappop(self._heap)
+            due.append(url)
+        return due
+
+    def report(self, url: str, guids: Optional[Iterable[str]], ok: bool, now: Optional[float] = None):
+        """Результат опроса ленты: пересчитать интервал и вернуть её в очередь."""
+        st = self.feeds.get(url)
+        if st is None:
+            return
+        now = time.monotonic() if now is None else now
+        if ok:
+            st.failures = 0
+            current = {g for g in (guids or ()) if g}
+            if st.seen is not None and st.last_fetch is not None:
+                new = len(current - st.seen)
+                elapsed = max(1.0, now - st.last_fetch)
+                observed = new / elapsed
+                st.rate = observed if st.rate is None else (1 - RATE_EWMA_ALPHA) * st.rate + RATE_EWMA_ALPHA * observed
+                if current and new == len(current):
+                    # всё окно ленты новое — часть публикаций мы, скорее всего, пропустили
+                    st.interval /= 2
+                elif st.rate > 0:
+                    st.interval = SCHED_TARGET_NEW_PER_POLL / st.rate
+                else:
+                    st.interval *= 1.5
+                st.interval = min(max(st.interval, st.min_interval), st.max_interval)
+            st.seen = current
+            st.last_fetch = now
+            delay = st.interval * random.uniform(1 - JITTER, 1 + JITTER)
+        else:
+            st.failures += 1
+            backoff = min(st.interval * (2 ** st.failures), SCHED_MAX_BACKOFF_SEC)
+            delay = backoff * random.uniform(0.5, 1.0)   # equal jitter
+            logging.info(f"Feed {url} failed {st.failures}x, next try in {int(delay)}s")
+        st.next_due = now + delay
+        heapq.heappush(self._heap, (st.next_due, url))
+
+    def requeue(self, url: str, now: Optional[float] = None):
+        """Вернуть ленту в очередь без пересчёта интервала (цикл упал до её опроса)."""
+        st = self.feeds.get(url)
+        if st is None:
+            return
+        now = time.monotonic() if now is None else now
+        st.next_due = now + st.interval
+        heapq.heappush(self._heap, (st.next_due, url))
+
+    def stats(self) -> dict:
+        if not self.feeds:
+            return {"feeds": 0}
+        intervals = sorted(st.interval for st in self.feeds.values())
+        return {
+            "feeds": len(self.feeds),
+            "failing": sum(1 for st in self.feeds.values() if st.failures),
+            "interval_min": int(intervals[0]),
+            "interval_median": int(intervals[len(intervals) // 2]),
+            "interval_max": int(intervals[-1]),
+        }
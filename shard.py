@@ -0,0 +1,47 @@
+import os, bisect, hashlib
+from typing import Iterable
+
+# Несколько процессов над одной data.db: ленты делятся между ними по хешу URL,
+# отправку, дайджест и команды бота ведёт один выбранный (lease.LeaderElection).
+SHARD_COUNT = max(1, int(os.getenv("SHARD_COUNT", "1")))
+SHARD_INDEX = int(os.getenv("SHARD_INDEX", "0"))
+# владелец лизов и заявок; по умолчанию стабилен между рестартами процесса шарда
+WORKER_ID = os.getenv("WORKER_ID", f"shard-{SHARD_INDEX}")
+SHARD_VNODES = int(os.getenv("SHARD_VNODES", "64"))
+
+if not 0 <= SHARD_INDEX < SHARD_COUNT:
+    raise RuntimeError(f"SHARD_INDEX должен быть от 0 до {SHARD_COUNT - 1}")
+
+
+def _h64(s: str) -> int:
+    return int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class HashRing:
+    """Консистентное хеширование: ключ → узел.
+
+    У каждого узла vnodes точек на кольце; при смене числа узлов переезжает
+    примерно 1/N ключей, так что у остальных лент сохраняются feed_state и кэш.
+    """
+
+    def __init__(self, nodes: Iterable[str], vnodes: int = SHARD_VNODES):
+        self.nodes = list(nodes)
+        ring = sorted((_h64(f"{n}#{v}"), n) for n in self.nodes for v in range(max(1, vnodes)))
+        self._points = [h for h, _ in ring]
+        self._owners = [n for _, n in ring]
+
+    def node_for(self, key: str) -> str:
+        i = bisect.bisect(self._points, _h64(key)) % len(self._points)
+        return self._owners[i]
+
+
+def shard_name(index: int) -> str:
+    return f"shard-{index}"
+
+
+ring = HashRing(shard_name(i) for i in range(SHARD_COUNT))
+
+
+def owns(key: str) -> bool:
+    """Этот процесс отвечает за ключ (URL ленты)."""
+    return SHARD_COUNT == 1 or ring.node_for(key) == shard_name(SHARD_INDEX)
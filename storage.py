@@ -0,0 +1,198 @@
+import os, time, sqlite3, asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Optional
+
+from metrics import DB_QUERY_SECONDS
+
+POSTED_RETENTION_DAYS = int(os.getenv("POSTED_RETENTION_DAYS", "60"))
+ITEMS_RETENTION_DAYS = int(os.getenv("ITEMS_RETENTION_DAYS", "14"))
+VACUUM_MIN_FREE_PAGES = int(os.getenv("VACUUM_MIN_FREE_PAGES", "1000"))
+SQLITE_MAX_VARS = 500   # с запасом под старые сборки SQLite (лимит 999)
+
+FEED_STATE_FIELDS = ("etag", "last_modified", "last_success", "failures", "last_guid")
+
+TABLES = [
+    """
+    CREATE TABLE IF NOT EXISTS posted (
+        guid TEXT PRIMARY KEY,
+        ts   TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS items (
+        guid TEXT PRIMARY KEY,
+        ts   TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        title TEXT,
+        summary TEXT,
+        link TEXT,
+        priority REAL DEFAULT 0.0,
+        urgent INTEGER DEFAULT 0,
+        headline_ru TEXT,
+        comment_ru TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS feed_state (
+        url           TEXT PRIMARY KEY,
+        etag          TEXT,
+        last_modified TEXT,
+        last_success  REAL,
+        failures      INTEGER DEFAULT 0,
+        last_guid     TEXT
+    )
+    """,
+]
+
+INDEXES = [
+    # дайджест после рестарта: WHERE ts >= ?
+    "CREATE INDEX IF NOT EXISTS idx_items_ts_urgent_priority ON items(ts, urgent, priority)",
+    "CREATE INDEX IF NOT EXISTS idx_posted_ts ON posted(ts)",
+]
+
+
+class Store:
+    """Одно долгоживущее соединение SQLite (WAL) в отдельном потоке.
+
+    Все запросы идут через однопоточный executor, поэтому event loop не ждёт
+    диск, а соединение (и кэш подготовленных выражений sqlite3) живёт всё время
+    работы процесса.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self._con: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._con is None:
+            con = sqlite3.connect(self.path, timeout=30, cached_statements=256)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            con.execute("PRAGMA busy_timeout=30000")
+            self._con = con
+        return self._con
+
+    def _call(self, fn: Callable, *args):
+        with DB_QUERY_SECONDS.time(op=f"{fn.__module__}.{fn.__name__.lstrip('_')}"):
+            return fn(self._connect(), *args)
+
+    async def run(self, fn: Callable[..., Any], *args) -> Any:
+        """Выполнить fn(con, *args) в потоке БД."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._call, fn, *args)
+
+    async def close(self):
+        def _close(con):
+            con.close()
+            self._con = None
+        if self._con is not None:
+            await self.run(_close)
+        self._executor.shutdown(wait=True)
+
+    # === schema ===
+    async def init(self):
+        await self.run(_init_schema)
+
+    # === posted / items ===
+    async def posted_among(self, guids: Iterable[str]) -> set[str]:
+        return await self.run(_posted_among, [g for g in guids if g])
+
+    async def all_posted_guids(self) -> list[str]:
+        return await self.run(_all_posted_guids)
+
+    async def mark_posted_many(self, rows: list[tuple[str, str, str, str, float, bool]]):
+        """rows: (guid, title, summary, link, priority, urgent) — одной транзакцией."""
+        if rows:
+            await self.run(_mark_posted_many, rows)
+
+    async def count_posted_since(self, ts: str) -> int:
+        """ts — строка в формате CURRENT_TIMESTAMP (UTC)."""
+        return await self.run(_count_posted_since, ts)
+
+    async def read_digest_items(self, hours: int):
+        return await self.run(_read_digest_items, hours)
+
+    # === feed_state ===
+    async def load_feed_states(self) -> dict[str, dict]:
+        return await self.run(_load_feed_states)
+
+    async def save_feed_states(self, states: dict[str, dict]):
+        await self.run(_save_feed_states, states)
+
+    # === retention ===
+    async def retention(self) -> dict:
+        return await self.run(_retention)
+
+
+def _init_schema(con: sqlite3.Connection):
+    for stmt in TABLES:
+        con.execute(stmt)
+    cols = {r[1] for r in con.execute("PRAGMA table_info(feed_state)")}
+    if "last_guid" not in cols:
+        con.execute("ALTER TABLE feed_state ADD COLUMN last_guid TEXT")
+    # хеш тела больше не нужен: потоковый разбор сам останавливается на виденном guid
+    if "body_hash" in cols and sqlite3.sqlite_version_info >= (3, 35, 0):
+        con.execute("ALTER TABLE feed_state DROP COLUMN body_hash")
+    cols = {r[1] for r in con.execute("PRAGMA table_info(items)")}
+    for col in ("headline_ru", "comment_ru"):
+        if col not in cols:
+            con.execute(f"ALTER TABLE items ADD COLUMN {col} TEXT")
+    for stmt in INDEXES:
+        con.execute(stmt)
+    con.commit()
+
+def _posted_among(con: sqlite3.Connection, guids: list[str]) -> set[str]:
+    found = set()
+    for i in range(0, len(guids), SQLITE_MAX_VARS):
+        chunk = guids[i:i + SQLITE_MAX_VARS]
+        q = f"SELECT guid FROM posted WHERE guid IN ({','.join('?' * len(chunk))})"
+        found.update(r[0] for r in con.execute(q, chunk))
+    return found
+
+def _all_posted_guids(con: sqlite3.Connection) -> list[str]:
+    return [r[0] for r in con.execute("SELECT guid FROM posted")]
+
+def _mark_posted_many(con: sqlite3.Connection, rows):
+    # row: (guid, title, summary, link, priority, urgent[, headline_ru, comment_ru])
+    with con:
+        con.executemany("INSERT OR IGNORE INTO posted (guid) VALUES (?)", [(r[0],) for r in rows])
+        con.executemany("""INSERT OR REPLACE INTO items (guid, ts, title, summary, link, priority, urgent,
+                                                         headline_ru, comment_ru)
+                           VALUES (?, CURRENT_TIMESTAMP, ?, ?, ?, ?, ?, ?, ?)""",
+                        [(g, ti or "", su or "", ln or "", float(pr), 1 if urg else 0, *(list(dg) + [None, None])[:2])
+                         for g, ti, su, ln, pr, urg, *dg in rows])
+
+def _count_posted_since(con: sqlite3.Connection, ts: str) -> int:
+    return con.execute("SELECT COUNT(*) FROM posted WHERE ts >= ?", (ts,)).fetchone()[0]
+
+def _read_digest_items(con: sqlite3.Connection, hours: int):
+    return con.execute("""SELECT guid, ts, title, summary, link, priority, urgent, headline_ru, comment_ru
+                          FROM items
+                          WHERE ts >= datetime('now', ?)""", (f'-{hours} hours',)).fetchall()
+
+def _load_feed_states(con: sqlite3.Connection) -> dict[str, dict]:
+    rows = con.execute(f"SELECT url, {', '.join(FEED_STATE_FIELDS)} FROM feed_state").fetchall()
+    return {r[0]: dict(zip(FEED_STATE_FIELDS, r[1:])) for r in rows}
+
+def _save_feed_states(con: sqlite3.Connection, states: dict[str, dict]):
+    with con:
+        con.executemany(f"""INSERT OR REPLACE INTO feed_state (url, {', '.join(FEED_STATE_FIELDS)})
+                            VALUES (?{', ?' * len(FEED_STATE_FIELDS)})""",
+                        [(url, *(st.get(k) for k in FEED_STATE_FIELDS)) for url, st in states.items()])
+
+def _retention(con: sqlite3.Connection) -> dict:
+    t0 = time.perf_counter()
+    with con:
+        posted = con.execute("DELETE FROM posted WHERE ts < datetime('now', ?)",
+                             (f'-{POSTED_RETENTION_DAYS} days',)).rowcount
+        items = con.execute("DELETE FROM items WHERE ts < datetime('now', ?)",
+                            (f'-{ITEMS_RETENTION_DAYS} days',)).rowcount
+    free_pages = con.execute("PRAGMA freelist_count").fetchone()[0]
+    vacuumed = False
+    if free_pages >= VACUUM_MIN_FREE_PAGES:
+        con.execute("VACUUM")
+        vacuumed = True
+    con.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    con.execute("PRAGMA optimize")
+    return {"posted_deleted": posted, "items_deleted": items, "free_pages": free_pages,
+            "vacuumed": vacuumed, "sec": round(time.perf_counter() - t0, 2)}
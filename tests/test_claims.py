@@ -0,0 +1,68 @@
+import os, sys, tempfile, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "1:test")
+os.environ.setdefault("CHANNEL_ID", "-1001")
+os.environ["SHARD_COUNT"] = "2"
+
+import main
+from item import Item
+
+
+def entry(guid: str, title: str, urgent: bool = False):
+    return (1.0, urgent, Item(guid, title, f"http://example.com/{guid}", ""))
+
+
+class ClaimAfterCapTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        main.store.path = os.path.join(self.tmp.name, "data.db")
+        await main.store.init()
+        await main.leases.init()
+        await main.stories.init()
+        await main.outbox.init()
+        await main.dedup.warm()
+        main.stories.begin_cycle()
+
+    async def asyncTearDown(self):
+        await main.store.run(lambda con: con.close())
+        main.store._con = None
+        self.tmp.cleanup()
+
+    async def test_held_back_item_is_claimed_next_cycle_by_same_owner(self):
+        a = entry("g1", "Oil prices jump on supply cuts")
+        b = entry("g2", "Central bank keeps key rate unchanged")
+
+        # цикл 1: лимит 1 — вторая новость ждёт и заявку не получает
+        take, held = main.cap_cycle([a, b], admitted=0, limit=1)
+        self.assertEqual((take, held), ([a], [b]))
+        self.assertEqual(await main.claim_items(take), [a])
+
+        # цикл 2: тот же шард берёт отложенную
+        take, _ = main.cap_cycle(held, admitted=0, limit=1)
+        self.assertEqual(await main.claim_items(take), [b])
+        # а уже заявленную повторно — нет
+        self.assertEqual(await main.claim_items([a]), [])
+
+    async def test_unclaim_releases_guid_and_story(self):
+        a = entry("g1", "Oil prices jump on supply cuts")
+        self.assertEqual(await main.claim_items([a]), [a])
+        await main.leases.unclaim(["g1"])
+        self.assertEqual(await main.claim_items([a]), [a])
+
+
+    async def test_follower_does_not_readmit_what_it_enqueued(self):
+        # шард не лидер: outbox не запущен, доставку отметит другой процесс
+        a = entry("g1", "Oil prices jump on supply cuts")
+        b = entry("g2", "Central bank keeps key rate unchanged")
+        self.assertEqual(await main.claim_items([a]), [a])
+        await main.enqueue_post(a[2], a[0], a[1], "text", "Нефть дорожает", "Суть")
+        self.assertEqual(main.outbox.pending_guids(), set())
+
+        # следующий цикл: поставленное не занимает место, отложенное проходит
+        admitted = await main.admit_items(main.score_items([a[2], b[2]]), set())
+        self.assertEqual([e[2].key for e in admitted], ["g2"])
+
+
+if __name__ == "__main__":
+    unittest.main()